@@ -1,4 +1,13 @@
 #!/usr/bin/env python3
+# /// script
+# requires-python = ">=3.7.16"
+# dependencies = [
+#     "openpyxl>=3.1.0",
+#     "xlrd>=2.0.0",
+#     "loguru>=0.6.0",
+#     "numpy>=1.21",
+# ]
+# ///
 """
 Excel檔案分析工具
 分析Excel檔案中各個sheet的大小和內容分佈
@@ -10,9 +19,13 @@ from pathlib import Path
 import openpyxl
 from openpyxl.utils import get_column_letter
 import argparse
+from excel_analyzer_cli import style_census_workbook
 
-def analyze_sheet(sheet):
-    """分析單個工作表的詳細資訊"""
+def analyze_sheet(sheet, census):
+    """分析單個工作表的詳細資訊
+
+    census 為 style_census_workbook() 中該工作表的串流樣式統計
+    """
     print(f"\n=== 分析工作表: {sheet.title} ===")
     
     # 獲取實際使用的範圍
@@ -45,27 +58,14 @@ def analyze_sheet(sheet):
     print(f"  掃描的儲存格總數: {cell_count}")
     print(f"  有內容的儲存格數: {non_empty_cells}")
     
-    # 檢查是否有格式化但沒有內容的儲存格
-    formatted_empty_cells = 0
-    if sheet.max_column > 100:  # 如果列數異常多，檢查格式化問題
-        print(f"  警告: 列數異常多({sheet.max_column})，檢查格式化問題...")
-        
-        # 檢查前100列的格式化情況
-        for col_idx in range(1, min(101, sheet.max_column + 1)):
-            for row_idx in range(1, min(101, sheet.max_row + 1)):
-                cell = sheet.cell(row=row_idx, column=col_idx)
-                if (cell.value is None and 
-                    (cell.fill.start_color.index != '00000000' or
-                     cell.border.left.style is not None or
-                     cell.border.right.style is not None or
-                     cell.border.top.style is not None or
-                     cell.border.bottom.style is not None or
-                     cell.font.bold or
-                     cell.alignment.horizontal is not None)):
-                    formatted_empty_cells += 1
-    
-    if formatted_empty_cells > 0:
-        print(f"  發現 {formatted_empty_cells} 個格式化但沒有內容的儲存格")
+    # 檢查是否有格式化但沒有內容的儲存格（整個工作表的串流統計，不逐格讀取樣式物件）
+    if census['phantom_cells'] > 0:
+        print(f"  發現 {census['phantom_cells']:,} 個沒有內容卻撐大範圍的儲存格")
+        print(f"  有值範圍: {census['value_rows']:,} x {census['value_cols']}，"
+              f"格式延伸至: {census['styled_rows']:,} x {census['styled_cols']}")
+        for style in census['phantom_styles'][:5]:
+            print(f"    樣式 {style['style_id']} ({style['xf']}): {style['cells']:,} 個儲存格，"
+                  f"延伸至第 {style['max_row']:,} 行、第 {style['max_col']} 列")
     
     # 顯示一些範例內容
     print(f"  前5行內容範例:")
@@ -98,6 +98,7 @@ def main():
     try:
         # 載入Excel檔案
         workbook = openpyxl.load_workbook(excel_path, read_only=False, data_only=False)
+        census = style_census_workbook(excel_path)
         
         print(f"\n工作表列表:")
         for i, sheet_name in enumerate(workbook.sheetnames):
@@ -108,13 +109,13 @@ def main():
         if 'product' in workbook.sheetnames:
             print(f"\n=== 重點分析 'product' 工作表 ===")
             product_sheet = workbook['product']
-            analyze_sheet(product_sheet)
+            analyze_sheet(product_sheet, census['product'])
         
         # 分析其他工作表以作比較
         for sheet_name in workbook.sheetnames:
             if sheet_name != 'product':
                 sheet = workbook[sheet_name]
-                analyze_sheet(sheet)
+                analyze_sheet(sheet, census[sheet_name])
         
         workbook.close()
         
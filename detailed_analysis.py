@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
+# /// script
+# requires-python = ">=3.7.16"
+# dependencies = [
+#     "openpyxl>=3.1.0",
+#     "xlrd>=2.0.0",
+#     "loguru>=0.6.0",
+#     "numpy>=1.21",
+# ]
+# ///
 """
 深度分析Excel檔案的問題
 """
 
 import openpyxl
+import numpy as np
 from pathlib import Path
 import sys
+from excel_analyzer_cli import style_census_workbook
 
-def analyze_product_sheet_dimensions(sheet):
-    """深度分析product工作表的尺寸問題"""
+def analyze_product_sheet_dimensions(sheet, census):
+    """深度分析product工作表的尺寸問題
+
+    census 為 style_census_workbook() 中該工作表的串流樣式統計
+    """
     print(f"=== 深度分析 {sheet.title} 工作表尺寸問題 ===")
     
     # 檢查Excel內部記錄的尺寸
@@ -41,24 +55,17 @@ def analyze_product_sheet_dimensions(sheet):
         print(f"   - 實際只有 {actual_max_row} 行有內容")
         print(f"   - 空白行數量: {sheet.max_row - actual_max_row:,}")
         
-        # 檢查最後幾行是否有隱藏內容
-        print(f"   檢查最後10行是否有隱藏格式...")
-        for row_idx in range(max(1, sheet.max_row - 10), sheet.max_row + 1):
-            row_has_format = False
-            for col_idx in range(1, min(41, sheet.max_column + 1)):
-                try:
-                    cell = sheet.cell(row=row_idx, column=col_idx)
-                    if (cell.fill.start_color.index != '00000000' or
-                        cell.border.left.style is not None or
-                        cell.font.bold or 
-                        cell.alignment.horizontal is not None):
-                        row_has_format = True
-                        break
-                except:
-                    pass
-            
-            if row_has_format:
-                print(f"   第 {row_idx:,} 行有格式化但沒有內容")
+        # 有值內容結束後仍有儲存格的行，全部來自只有格式的儲存格
+        row_cell_end = census['row_cell_end']
+        styled_only_rows = np.flatnonzero(row_cell_end[census['value_rows'] + 1:]) + census['value_rows'] + 1
+        print(f"   有值內容結束於第 {census['value_rows']:,} 行，之後仍有 {len(styled_only_rows):,} 行只有格式")
+        for row_idx in styled_only_rows[-10:]:
+            print(f"   第 {row_idx:,} 行有格式化但沒有內容（至第 {row_cell_end[row_idx]} 列）")
+        
+        print(f"   撐大範圍的樣式:")
+        for style in census['phantom_styles'][:5]:
+            print(f"   - 樣式 {style['style_id']} ({style['xf']}): {style['cells']:,} 個儲存格，"
+                  f"延伸至第 {style['max_row']:,} 行、第 {style['max_col']} 列")
     
     # 2. 檢查工作表是否有定義的範圍
     print(f"\n2. 工作表已定義範圍檢查:")
@@ -85,7 +92,8 @@ def main():
         # 分析product工作表
         if 'product' in workbook.sheetnames:
             product_sheet = workbook['product']
-            actual_row, actual_col = analyze_product_sheet_dimensions(product_sheet)
+            census = style_census_workbook(excel_path)
+            actual_row, actual_col = analyze_product_sheet_dimensions(product_sheet, census['product'])
             
             print(f"\n=== 修復建議 ===")
             print(f"1. product工作表的實際資料只有 {actual_row} 行 × {actual_col} 列")
@@ -16,16 +16,53 @@ Excel檔案分析器 - 使用uv script的獨立執行檔
 
 import sys
 import os
+import re
+import json
+import time
+import select
+import signal
+import socket
+import cProfile
+import tracemalloc
+import csv
+import hashlib
+import sqlite3
+import zlib
+import struct
+import tempfile
+from array import array
+from itertools import zip_longest
+import posixpath
+from urllib.parse import unquote
+import zipfile
+import xml.etree.ElementTree as ET
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 import argparse
 import shutil
-from datetime import datetime
+from datetime import datetime, timezone
 from loguru import logger
 import openpyxl
 from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import from_excel, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.formula.translate import Translator
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.writer.excel import ExcelWriter
 import xlrd
 
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組，執行紀錄不記錄記憶體峰值
+    resource = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 只有 --export parquet 需要
+    pa = None
+
 # 定義顏色調色板
 COLOR_PALETTES = [
     {
@@ -82,6 +119,132 @@ REGULAR_CELL_STYLE = {
     "alignment": Alignment(vertical="top", wrap_text=True)
 }
 
+# OOXML 套件關聯 (package relationships) 命名空間與關聯類型字尾
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+REL_TYPE_OFFICE_DOCUMENT = "/officeDocument"
+REL_TYPE_WORKSHEET = "/worksheet"
+REL_TYPE_SHARED_STRINGS = "/sharedStrings"
+REL_TYPE_STYLES = "/styles"
+REL_TYPE_PIVOT_CACHE_RECORDS = "/pivotCacheRecords"
+REL_TYPE_CALC_CHAIN = "/calcChain"
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+# 清理zip成員時移除的原因說明（依關聯類型）
+PRUNE_REASONS = {
+    REL_TYPE_PIVOT_CACHE_RECORDS: "樞紐分析快取記錄",
+    REL_TYPE_CALC_CHAIN: "計算鏈",
+}
+RELATIONSHIP_TAG_RE = re.compile(rb'<((?:\w+:)?)Relationship\b([^>]*?)(?:/>|>\s*</\1Relationship>)')
+OVERRIDE_TAG_RE = re.compile(rb'<((?:\w+:)?)Override\b([^>]*?)(?:/>|>\s*</\1Override>)')
+PIVOT_CACHE_DEFINITION_RE = re.compile(rb'<((?:\w+:)?)pivotCacheDefinition\b([^>]*?)>')
+
+# 快速讀取<dimension>標籤時只讀取工作表XML開頭的位元組數
+DIMENSION_PROBE_BYTES = 4096
+DIMENSION_RE = re.compile(rb'<(?:\w+:)?dimension\s+ref="([^"]+)"')
+
+# 工作表分析索引與執行紀錄的預設目錄：EXCEL_ANALYZER_CACHE_DIR > $XDG_CACHE_HOME/excel_analyzer > ~/.cache/excel_analyzer
+# 執行時才解析，找不到家目錄時（沒有HOME且UID不在passwd中）停用兩者而不中止
+CACHE_DIR_ENV = 'EXCEL_ANALYZER_CACHE_DIR'
+# 參數未指定路徑時使用預設位置的標記（None 表示停用）
+DEFAULT_STORE = object()
+
+# 工作表分析索引：以zip成員的 (CRC-32, 解壓縮大小) 記住每個工作表的分析結果，
+# 同一份活頁簿重新上傳時只需重新掃描內容有變動的工作表
+SHEET_INDEX_FILENAME = 'sheet_index.json'
+SHEET_INDEX_VERSION = 3
+SHEET_INDEX_MAX_ENTRIES = 5000
+
+# 分析結果中保留的幽靈範圍樣式數量（依儲存格數排序）
+PHANTOM_STYLES_REPORTED = 5
+
+# 寫出修復檔案時的壓縮等級（zlib 1-9）
+COMPRESSION_LEVELS = {'fast': 1, 'default': 6, 'max': 9}
+# 小於此大小的zip成員直接在主執行緒壓縮，不值得排入執行緒池
+PARALLEL_COMPRESS_MIN_BYTES = 64 * 1024
+# 大小、位移或成員數超過此限制時改寫ZIP64欄位
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_MAX_ENTRIES = 0xFFFF
+
+# 串流重寫工作表XML時使用的正規表示式與每次讀取的位元組數
+STREAM_CHUNK_BYTES = 1024 * 1024
+SHEET_DATA_START_RE = re.compile(rb'<((?:\w+:)?)sheetData\b([^>]*?)(/?)>')
+ROW_START_RE = re.compile(rb'<((?:\w+:)?)row\b([^>]*?)(/?)>')
+CELL_RE = re.compile(rb'<((?:\w+:)?)c\b([^>]*?)(?:/>|>(.*?)</\1c>)', re.S)
+XML_ATTR_RE = re.compile(rb'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+# 監看模式的佇列目錄結構與設定
+SPOOL_DIRS = ('inbox', 'work', 'done', 'failed')
+SPOOL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+LEASE_SUFFIX = '.lease'
+# 同一個檔案最多嘗試處理的次數（工作程序被OOM終止、主機當機都算一次），超過即移至 failed/
+SPOOL_MAX_ATTEMPTS = 3
+# 租約過期退回收件匣時，以隱藏檔 .<檔名>.attempts 保留已嘗試次數
+ATTEMPTS_SUFFIX = '.attempts'
+# inotify 事件：檔案寫入完成關閉、檔案被移入目錄
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+# 匯出：Parquet每批寫入的行數，檔名中不允許的字元
+EXPORT_BATCH_ROWS = 10000
+EXPORT_FILENAME_RE = re.compile(r'[\\/:*?"<>|]')
+
+# 效能剖析：--profile 啟用時記錄各工作表熱點路徑的計數，平時為 None 不做任何事
+PROFILE_COUNTERS = None
+PROFILE_TOP_ALLOCATIONS = 30
+
+# 執行紀錄：每次分析的檔案與各工作表結果附加到本機SQLite，供 stats 子命令彙整
+HISTORY_FILENAME = 'history.sqlite3'
+HISTORY_SCHEMA_VERSION = 1
+HISTORY_QUANTILES = (0.5, 0.9, 0.99)
+HISTORY_STAGES = ('analyze', 'fix', 'verify')
+# 啟用執行紀錄時收集本次執行的各階段耗時與各工作表分析結果，平時為 None 不做任何事
+RUN_RECORD = None
+# 本程序已開始的執行紀錄數，監看模式的工作程序會連續處理多個檔案
+RUN_RECORD_COUNT = 0
+
+def default_cache_dir():
+    """索引與執行紀錄的預設目錄，找不到家目錄時回傳 None"""
+    override = os.environ.get(CACHE_DIR_ENV)
+    if override:
+        return Path(override)
+    xdg_cache = os.environ.get('XDG_CACHE_HOME')
+    if xdg_cache:
+        return Path(xdg_cache) / 'excel_analyzer'
+    try:
+        return Path.home() / '.cache' / 'excel_analyzer'
+    except (RuntimeError, KeyError):
+        return None
+
+def resolve_store_path(path, filename, label):
+    """將 DEFAULT_STORE 換成預設目錄下的檔案；找不到家目錄時記錄警告並回傳 None（停用）"""
+    if path is not DEFAULT_STORE:
+        return path
+    cache_dir = default_cache_dir()
+    if cache_dir is None:
+        logger.warning(f"找不到家目錄，停用{label}（可設定 {CACHE_DIR_ENV} 指定存放目錄）")
+        return None
+    return str(cache_dir / filename)
+
+def record_stage(stage, seconds):
+    """累加執行紀錄中某個階段（analyze、fix、verify）的耗時"""
+    if RUN_RECORD is None:
+        return
+    RUN_RECORD['stages'][stage] = RUN_RECORD['stages'].get(stage, 0.0) + seconds
+
+def record_sheet(sheet_name, analysis):
+    """將工作表分析結果加入執行紀錄"""
+    if RUN_RECORD is None:
+        return
+    RUN_RECORD['sheets'].append((sheet_name, analysis))
+
+def count_profile(sheet_name, **deltas):
+    """累加工作表的剖析計數（cells_visited、cells_created、rows_written、style_assignments、bytes_read、bytes_written）"""
+    if PROFILE_COUNTERS is None:
+        return
+    counters = PROFILE_COUNTERS.setdefault(sheet_name, {})
+    for key, value in deltas.items():
+        counters[key] = counters.get(key, 0) + value
+
 def analyze_sheet_size(sheet):
     """分析工作表的尺寸問題 (openpyxl工作表)"""
     # 獲取實際使用的範圍
@@ -90,6 +253,8 @@ def analyze_sheet_size(sheet):
     cell_count = 0
     non_empty_cells = 0
     
+    reverse_visited = 0
+    
     # 智慧掃描策略：先快速掃描找到大概範圍，再精確掃描
     reported_rows = sheet.max_row
     reported_cols = sheet.max_column
@@ -110,6 +275,7 @@ def analyze_sheet_size(sheet):
             for col_idx in range(1, min(reported_cols + 1, 100)):
                 try:
                     cell = sheet.cell(row=row_idx, column=col_idx)
+                    reverse_visited += 1
                     if cell.value is not None and str(cell.value).strip():
                         actual_max_row = max(actual_max_row, row_idx)
                         has_content = True
@@ -139,6 +305,8 @@ def analyze_sheet_size(sheet):
     if actual_max_col == 0:
         actual_max_col = 1
     
+    count_profile(sheet.title, cells_visited=cell_count + reverse_visited)
+    
     return {
         'reported_rows': reported_rows,
         'reported_cols': reported_cols,
@@ -156,6 +324,7 @@ def analyze_xls_sheet_size(sheet):
     actual_max_col = 0
     cell_count = 0
     non_empty_cells = 0
+    reverse_visited = 0
     
     # 智慧掃描策略：先快速掃描找到大概範圍，再精確掃描
     reported_rows = sheet.nrows
@@ -174,6 +343,7 @@ def analyze_xls_sheet_size(sheet):
             has_content = False
             for col_idx in range(0, min(reported_cols, 100)):
                 try:
+                    reverse_visited += 1
                     cell_value = sheet.cell_value(row_idx, col_idx)
                     if cell_value is not None and str(cell_value).strip():
                         actual_max_row = max(actual_max_row, row_idx + 1)  # 轉換為1-based索引
@@ -203,6 +373,8 @@ def analyze_xls_sheet_size(sheet):
     if actual_max_col == 0:
         actual_max_col = 1
     
+    count_profile(sheet.name, cells_visited=cell_count + reverse_visited)
+    
     return {
         'reported_rows': reported_rows,
         'reported_cols': reported_cols,
@@ -213,6 +385,775 @@ def analyze_xls_sheet_size(sheet):
         'has_size_issue': (reported_rows > actual_max_row * 5 and reported_rows > 100) or (reported_cols > actual_max_col * 5 and reported_cols > 50)
     }
 
+def _resolve_part_target(source_part, target):
+    """將關聯檔中的Target解析為zip內的完整路徑"""
+    target = unquote(target)
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+def _rels_path(part):
+    """取得某個part對應的.rels檔路徑"""
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', f"{name}.rels")
+
+def _read_rels(zf, part):
+    """讀取某個part的關聯 {rId: (type, 完整路徑, TargetMode)}"""
+    rels_path = _rels_path(part)
+    if rels_path not in zf.NameToInfo:
+        return {}
+    rels = {}
+    root = ET.fromstring(zf.read(rels_path))
+    for rel in root.iter(f"{{{PKG_REL_NS}}}Relationship"):
+        mode = rel.get('TargetMode')
+        target = rel.get('Target', '')
+        if mode != 'External':
+            target = _resolve_part_target(part, target)
+        rels[rel.get('Id')] = (rel.get('Type', ''), target, mode)
+    return rels
+
+def _local_name(tag):
+    """去除XML標籤的命名空間"""
+    return tag.rsplit('}', 1)[-1]
+
+def read_workbook_parts(zf):
+    """從zip內容解析活頁簿與各工作表的XML路徑
+
+    Returns:
+        dict: {
+            'workbook': str,               # workbook.xml 路徑
+            'sheets': [(name, part), ...], # 依活頁簿順序排列的工作表
+            'shared_strings': str or None, # sharedStrings.xml 路徑
+            'styles': str or None,         # styles.xml 路徑
+            'date1904': bool               # 日期序號是否以1904年為基準（舊版Mac活頁簿）
+        }
+    """
+    workbook_part = 'xl/workbook.xml'
+    for rel_type, target, _ in _read_rels(zf, '').values():
+        if rel_type.endswith(REL_TYPE_OFFICE_DOCUMENT):
+            workbook_part = target
+            break
+
+    workbook_rels = _read_rels(zf, workbook_part)
+    shared_strings = None
+    styles = None
+    for rel_type, target, _ in workbook_rels.values():
+        if rel_type.endswith(REL_TYPE_SHARED_STRINGS):
+            shared_strings = target
+        elif rel_type.endswith(REL_TYPE_STYLES):
+            styles = target
+
+    sheets = []
+    date1904 = False
+    root = ET.fromstring(zf.read(workbook_part))
+    for elem in root.iter():
+        if _local_name(elem.tag) == 'workbookPr':
+            date1904 = elem.get('date1904', '').lower() in ('1', 'true')
+            continue
+        if _local_name(elem.tag) != 'sheet':
+            continue
+        rel_id = next((value for key, value in elem.attrib.items() if _local_name(key) == 'id'), None)
+        rel_type, target, _ = workbook_rels.get(rel_id, ('', None, None))
+        # 只處理一般工作表，圖表工作表沒有儲存格資料
+        if target and rel_type.endswith(REL_TYPE_WORKSHEET):
+            sheets.append((elem.get('name'), target))
+
+    return {'workbook': workbook_part, 'sheets': sheets, 'shared_strings': shared_strings, 'styles': styles,
+            'date1904': date1904}
+
+def load_shared_strings(zf, part):
+    """串流讀取共用字串表"""
+    strings = []
+    if not part or part not in zf.NameToInfo:
+        return strings
+    with zf.open(part) as fp:
+        for _, elem in ET.iterparse(fp):
+            if _local_name(elem.tag) != 'si':
+                continue
+            # 只取 <t> 與 <r><t>，略過注音標示 <rPh>
+            text = []
+            for child in elem:
+                name = _local_name(child.tag)
+                if name == 't':
+                    text.append(child.text or '')
+                elif name == 'r':
+                    for run_text in child:
+                        if _local_name(run_text.tag) == 't':
+                            text.append(run_text.text or '')
+            strings.append(''.join(text))
+            elem.clear()
+    return strings
+
+def load_date_style_ids(zf, part):
+    """回傳使用日期/時間數字格式的儲存格樣式索引 (cellXfs) 集合"""
+    date_styles = set()
+    if not part or part not in zf.NameToInfo:
+        return date_styles
+    root = ET.fromstring(zf.read(part))
+    custom_formats = {}
+    for elem in root.iter():
+        if _local_name(elem.tag) == 'numFmt':
+            custom_formats[int(elem.get('numFmtId', 0))] = elem.get('formatCode', '')
+    for elem in root:
+        if _local_name(elem.tag) != 'cellXfs':
+            continue
+        for style_id, xf in enumerate(elem):
+            fmt_id = int(xf.get('numFmtId', 0))
+            fmt = custom_formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id, 'General'))
+            if is_date_format(fmt):
+                date_styles.add(style_id)
+    return date_styles
+
+def load_cell_xfs(zf, part):
+    """回傳每個儲存格樣式索引 (cellXfs) 的屬性，例如 {'numFmtId': '0', 'fontId': '1', 'fillId': '2', ...}"""
+    if not part or part not in zf.NameToInfo:
+        return []
+    root = ET.fromstring(zf.read(part))
+    for elem in root:
+        if _local_name(elem.tag) == 'cellXfs':
+            return [dict(xf.attrib) for xf in elem]
+    return []
+
+def describe_cell_xf(cell_xfs, style_id):
+    """以非預設的 font/fill/border/numFmt 編號簡述樣式，例如 'fillId=2 borderId=1'"""
+    if style_id >= len(cell_xfs):
+        return '（樣式表中不存在）'
+    xf = cell_xfs[style_id]
+    parts = [f"{key}={xf[key]}" for key in ('numFmtId', 'fontId', 'fillId', 'borderId') if xf.get(key, '0') != '0']
+    return ' '.join(parts) or '預設格式'
+
+def split_cell_ref(ref):
+    """將 'AB12' 拆為 (12, 28)"""
+    col = 0
+    for pos, char in enumerate(ref):
+        if 'A' <= char <= 'Z':
+            col = col * 26 + ord(char) - 64
+        elif 'a' <= char <= 'z':
+            col = col * 26 + ord(char) - 96
+        else:
+            return int(ref[pos:]), col
+    return 0, col
+
+def read_dimension_ref(zf, part):
+    """只讀取工作表XML開頭，取得<dimension>記錄的 (行數, 列數)"""
+    with zf.open(part) as fp:
+        head = fp.read(DIMENSION_PROBE_BYTES)
+    match = DIMENSION_RE.search(head)
+    if not match:
+        return 0, 0
+    last_ref = match.group(1).decode('ascii', 'replace').split(':')[-1].replace('$', '')
+    rows, cols = split_cell_ref(last_ref)
+    return rows, cols
+
+def _convert_cell_value(cell_type, raw, shared_strings):
+    """將XML中的原始值轉為Python值（與openpyxl讀取的結果一致）"""
+    if cell_type == 's':
+        try:
+            return shared_strings[int(raw)]
+        except (IndexError, ValueError):
+            return None
+    if cell_type in ('str', 'inlineStr', 'e', 'd'):
+        return raw
+    if cell_type == 'b':
+        return raw.strip() in ('1', 'true')
+    try:
+        if raw.lstrip('-').isdigit():
+            return int(raw)
+        return float(raw)
+    except ValueError:
+        return raw
+
+def iter_sheet_cells(zf, part, shared_strings, formulas=True):
+    """串流讀取工作表XML中的所有儲存格，記憶體用量固定
+
+    Args:
+        formulas: True 時公式儲存格回傳 '=公式'（與openpyxl相同），False 時回傳快取的計算結果
+
+    Yields:
+        tuple: (row, col, value, style_id)  value 為 None 表示只有格式沒有內容
+    """
+    with zf.open(part) as fp:
+        context = ET.iterparse(fp, events=('start', 'end'))
+        _, root = next(context)
+        ns = root.tag[:-len('worksheet')] if root.tag.endswith('worksheet') else ''
+        row_tag, cell_tag, sheet_data_tag = f"{ns}row", f"{ns}c", f"{ns}sheetData"
+        v_tag, f_tag, is_tag, t_tag = f"{ns}v", f"{ns}f", f"{ns}is", f"{ns}t"
+
+        sheet_data = None
+        shared_formulas = {}
+        row_idx = 0
+        col_idx = 0
+        for event, elem in context:
+            tag = elem.tag
+            if event == 'start':
+                if tag == row_tag:
+                    row_ref = elem.get('r')
+                    row_idx = int(row_ref) if row_ref else row_idx + 1
+                    col_idx = 0
+                elif tag == sheet_data_tag:
+                    sheet_data = elem
+                continue
+
+            if tag == cell_tag:
+                ref = elem.get('r')
+                if ref:
+                    ref_row, col_idx = split_cell_ref(ref)
+                    row_idx = ref_row or row_idx
+                else:
+                    col_idx += 1
+
+                value = None
+                formula = None
+                for child in elem:
+                    child_tag = child.tag
+                    if child_tag == v_tag:
+                        if child.text is not None:
+                            value = _convert_cell_value(elem.get('t', 'n'), child.text, shared_strings)
+                    elif child_tag == f_tag and formulas:
+                        formula = child.text
+                        if child.get('t') == 'shared':
+                            # 共用公式只在第一格寫出內容，其餘儲存格依相對位置展開（與openpyxl相同）
+                            coordinate = ref or f"{get_column_letter(col_idx)}{row_idx}"
+                            shared_index = child.get('si')
+                            if formula:
+                                shared_formulas[shared_index] = (f"={formula}", coordinate)
+                            elif shared_index in shared_formulas:
+                                origin_formula, origin = shared_formulas[shared_index]
+                                formula = Translator(origin_formula, origin=origin).translate_formula(coordinate)[1:]
+                    elif child_tag == is_tag:
+                        value = ''.join(t.text or '' for t in child.iter(t_tag))
+                if formula:
+                    value = f"={formula}"
+
+                style = elem.get('s')
+                yield row_idx, col_idx, value, int(style) if style else 0
+            elif tag == row_tag and sheet_data is not None:
+                # 已處理完的行立即釋放，避免百萬行工作表佔用大量記憶體
+                sheet_data.clear()
+
+def scan_sheet_extents(cells):
+    """串流計算有值範圍、格式範圍與撐大範圍的樣式，記憶體用量與儲存格數無關
+
+    只保留目前的最大行列號，以及以 (樣式, 列號) 分組的空白儲存格計數：
+    尚未出現有值內容的行先記在 pending，之後的行出現有值內容時併入 body。
+    結束時 pending 全部落在有值範圍之下，body 中列號超過有值範圍者落在右側，
+    因此分組數量最多為「樣式數 x 列數」。工作表XML的行依規格遞增排列。
+
+    Args:
+        cells: iter_sheet_cells() 產出的 (row, col, value, style_id)
+
+    Returns:
+        dict: 與 style_census() 相同的統計欄位，但不含逐行/逐列陣列
+    """
+    cell_count = value_cells = 0
+    value_rows = value_cols = styled_rows = styled_cols = 0
+    body, pending = {}, {}
+    for row_idx, col_idx, value, style_id in cells:
+        cell_count += 1
+        if row_idx > styled_rows:
+            styled_rows = row_idx
+        if col_idx > styled_cols:
+            styled_cols = col_idx
+        if value is not None and str(value).strip():
+            value_cells += 1
+            if col_idx > value_cols:
+                value_cols = col_idx
+            if row_idx > value_rows:
+                value_rows = row_idx
+                for key, (count, max_row) in pending.items():
+                    stats = body.setdefault(key, [0, 0])
+                    stats[0] += count
+                    stats[1] = max(stats[1], max_row)
+                pending.clear()
+            continue
+        stats = (pending if row_idx > value_rows else body).setdefault((style_id, col_idx), [0, 0])
+        stats[0] += 1
+        if row_idx > stats[1]:
+            stats[1] = row_idx
+
+    phantom = {}
+    for group, in_phantom in ((pending, lambda col: True), (body, lambda col: col > value_cols)):
+        for (style_id, col_idx), (count, max_row) in group.items():
+            if not in_phantom(col_idx):
+                continue
+            style = phantom.setdefault(style_id, {'style_id': style_id, 'cells': 0, 'max_row': 0, 'max_col': 0})
+            style['cells'] += count
+            style['max_row'] = max(style['max_row'], max_row)
+            style['max_col'] = max(style['max_col'], col_idx)
+    phantom_styles = sorted(phantom.values(), key=lambda style: (-style['cells'], style['style_id']))
+
+    return {
+        'cells': cell_count,
+        'value_cells': value_cells,
+        'value_rows': value_rows,
+        'value_cols': value_cols,
+        'styled_rows': styled_rows,
+        'styled_cols': styled_cols,
+        'phantom_cells': sum(style['cells'] for style in phantom_styles),
+        'phantom_styles': phantom_styles,
+    }
+
+def style_census(cells):
+    """統計每個儲存格的樣式索引與是否有值，找出只有格式撐大的範圍
+
+    串流時把 (行, 列, 樣式, 是否有值) 存入緊湊陣列（每格11位元組，計算時另需數倍的暫存陣列），
+    之後以NumPy一次計算每行、每列有值內容在哪裡結束、只有格式的儲存格延伸到哪裡。
+    記憶體用量隨儲存格數成長，只用於報告與除錯；檢測流程請用 scan_sheet_extents()。
+    NumPy 只在這裡使用，於呼叫時才匯入，分析與修復流程不需要安裝。
+
+    Args:
+        cells: iter_sheet_cells() 產出的 (row, col, value, style_id)
+
+    Returns:
+        dict: {
+            'cells': int, 'value_cells': int,
+            'value_rows': int, 'value_cols': int,     # 有值內容的最後一行/列（沒有則為 0）
+            'styled_rows': int, 'styled_cols': int,   # 含只有格式的儲存格在內的最後一行/列
+            'row_value_end': ndarray, 'row_cell_end': ndarray,  # 以行號為索引，該行最後一個有值/任何儲存格的列號
+            'col_value_end': ndarray, 'col_cell_end': ndarray,  # 以列號為索引，該列最後一個有值/任何儲存格的行號
+            'phantom_cells': int,                     # 落在有值範圍之外的儲存格數
+            'phantom_styles': [{'style_id', 'cells', 'max_row', 'max_col'}, ...]  # 依儲存格數排序
+        }
+    """
+    import numpy as np
+
+    rows, cols, styles, values = array('I'), array('H'), array('I'), array('B')
+    for row_idx, col_idx, value, style_id in cells:
+        rows.append(row_idx)
+        cols.append(col_idx)
+        styles.append(style_id)
+        values.append(value is not None and bool(str(value).strip()))
+
+    row_arr = np.frombuffer(rows, dtype=np.uintc).astype(np.intp)
+    col_arr = np.frombuffer(cols, dtype=np.ushort).astype(np.intp)
+    style_arr = np.frombuffer(styles, dtype=np.uintc)
+    has_value = np.frombuffer(values, dtype=np.bool_)
+
+    styled_rows = int(row_arr.max()) if len(row_arr) else 0
+    styled_cols = int(col_arr.max()) if len(col_arr) else 0
+    row_cell_end = np.zeros(styled_rows + 1, dtype=np.intp)
+    row_value_end = np.zeros(styled_rows + 1, dtype=np.intp)
+    col_cell_end = np.zeros(styled_cols + 1, dtype=np.intp)
+    col_value_end = np.zeros(styled_cols + 1, dtype=np.intp)
+    np.maximum.at(row_cell_end, row_arr, col_arr)
+    np.maximum.at(row_value_end, row_arr[has_value], col_arr[has_value])
+    np.maximum.at(col_cell_end, col_arr, row_arr)
+    np.maximum.at(col_value_end, col_arr[has_value], row_arr[has_value])
+
+    value_row_ids = np.flatnonzero(row_value_end)
+    value_col_ids = np.flatnonzero(col_value_end)
+    value_rows = int(value_row_ids[-1]) if len(value_row_ids) else 0
+    value_cols = int(value_col_ids[-1]) if len(value_col_ids) else 0
+
+    # 有值範圍之外的儲存格必定沒有值，依樣式分組統計數量與延伸到的最遠位置
+    phantom = (row_arr > value_rows) | (col_arr > value_cols)
+    style_ids, inverse, counts = np.unique(style_arr[phantom], return_inverse=True, return_counts=True)
+    style_max_row = np.zeros(len(style_ids), dtype=np.intp)
+    style_max_col = np.zeros(len(style_ids), dtype=np.intp)
+    np.maximum.at(style_max_row, inverse, row_arr[phantom])
+    np.maximum.at(style_max_col, inverse, col_arr[phantom])
+    phantom_styles = [
+        {'style_id': int(style_ids[i]), 'cells': int(counts[i]),
+         'max_row': int(style_max_row[i]), 'max_col': int(style_max_col[i])}
+        for i in np.argsort(-counts, kind='stable')
+    ]
+
+    return {
+        'cells': len(row_arr),
+        'value_cells': int(np.count_nonzero(has_value)),
+        'value_rows': value_rows,
+        'value_cols': value_cols,
+        'styled_rows': styled_rows,
+        'styled_cols': styled_cols,
+        'row_value_end': row_value_end,
+        'row_cell_end': row_cell_end,
+        'col_value_end': col_value_end,
+        'col_cell_end': col_cell_end,
+        'phantom_cells': int(np.count_nonzero(phantom)),
+        'phantom_styles': phantom_styles,
+    }
+
+def style_census_workbook(excel_path):
+    """對活頁簿的每個工作表執行 style_census()，幽靈範圍樣式附上 cellXfs 屬性
+
+    Returns:
+        dict: {工作表名稱: style_census() 結果}，phantom_styles 每筆多一個 'xf' 描述
+    """
+    with zipfile.ZipFile(excel_path) as zf:
+        parts = read_workbook_parts(zf)
+        shared_strings = load_shared_strings(zf, parts['shared_strings'])
+        cell_xfs = load_cell_xfs(zf, parts['styles'])
+        census = {}
+        for sheet_name, part in parts['sheets']:
+            census[sheet_name] = style_census(iter_sheet_cells(zf, part, shared_strings))
+            for style in census[sheet_name]['phantom_styles']:
+                style['xf'] = describe_cell_xf(cell_xfs, style['style_id'])
+    return census
+
+def analyze_sheet_part(zf, part, shared_strings, sheet_name=None):
+    """串流分析工作表XML的尺寸問題，回傳格式與 analyze_sheet_size() 相同
+
+    另外附上 'phantom_styles'：撐大範圍最多儲存格的幾個樣式索引（見 scan_sheet_extents()）。
+    """
+    census = scan_sheet_extents(iter_sheet_cells(zf, part, shared_strings))
+
+    # 與openpyxl相同，空工作表視為 1 x 1
+    reported_rows = max(census['styled_rows'], 1)
+    reported_cols = max(census['styled_cols'], 1)
+    actual_max_row = max(census['value_rows'], 1)  # 至少保留標題行
+    actual_max_col = max(census['value_cols'], 1)
+
+    count_profile(sheet_name or part, cells_visited=census['cells'], bytes_read=zf.getinfo(part).file_size)
+
+    return {
+        'reported_rows': reported_rows,
+        'reported_cols': reported_cols,
+        'actual_rows': actual_max_row,
+        'actual_cols': actual_max_col,
+        'scanned_cells': census['cells'],
+        'non_empty_cells': census['value_cells'],
+        'phantom_styles': census['phantom_styles'][:PHANTOM_STYLES_REPORTED],
+        'has_size_issue': (reported_rows > actual_max_row * 5 and reported_rows > 100) or (reported_cols > actual_max_col * 5 and reported_cols > 50)
+    }
+
+def log_phantom_styles(analysis, cell_xfs):
+    """除錯訊息中列出撐大工作表範圍的樣式索引"""
+    for style in analysis.get('phantom_styles', []):
+        logger.debug(f"      樣式 {style['style_id']} ({describe_cell_xf(cell_xfs, style['style_id'])}): "
+                     f"{style['cells']:,} 個空白儲存格，延伸至第 {style['max_row']:,} 行、第 {style['max_col']} 列")
+
+def order_sheets_by_suspicion(zf, sheets):
+    """依便宜的指標排序工作表：<dimension>範圍大小優先，其次為壓縮後大小"""
+    def suspicion(item):
+        _, part = item
+        rows, cols = read_dimension_ref(zf, part)
+        return (rows * cols, zf.getinfo(part).compress_size)
+    return sorted(sheets, key=suspicion, reverse=True)
+
+def _member_key(info):
+    """zip中央目錄記錄的 CRC-32 與解壓縮大小，不需解壓縮即可判斷成員內容是否改變"""
+    return f"{info.CRC:08x}:{info.file_size}"
+
+def _blank_strings_digest(shared_strings):
+    """共用字串表中空白字串的索引摘要
+
+    工作表的分析結果只取決於工作表XML本身，以及其中參照的共用字串是否為空白，
+    因此共用字串表改變時，只要空白字串的位置不變，各工作表的索引項目仍然有效。
+    """
+    blank = ','.join(str(i) for i, text in enumerate(shared_strings) if not text.strip())
+    return hashlib.sha1(blank.encode('ascii')).hexdigest()[:16]
+
+def load_sheet_index(index_path):
+    """讀取工作表分析索引，檔案不存在、損毀或版本不符時回傳空索引"""
+    index = {'version': SHEET_INDEX_VERSION, 'sheets': {}, 'blank_strings': {}}
+    try:
+        data = json.loads(Path(index_path).read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return index
+    except (OSError, ValueError) as e:
+        logger.warning(f"無法讀取工作表索引 {index_path}，將重新建立: {e}")
+        return index
+    if isinstance(data, dict) and data.get('version') == SHEET_INDEX_VERSION:
+        index['sheets'] = data.get('sheets') or {}
+        index['blank_strings'] = data.get('blank_strings') or {}
+    return index
+
+def save_sheet_index(index, index_path):
+    """寫回工作表分析索引，工作表與共用字串摘要各只保留最近使用的項目
+
+    多個程序同時寫入時以最後寫入者為準，遺失的項目只會讓下次多掃描一次；
+    寫入失敗只記錄警告，不影響分析結果。
+    """
+    for section in ('sheets', 'blank_strings'):
+        entries = index[section]
+        if len(entries) > SHEET_INDEX_MAX_ENTRIES:
+            recent = sorted(entries.items(), key=lambda item: item[1].get('used', 0), reverse=True)
+            index[section] = dict(recent[:SHEET_INDEX_MAX_ENTRIES])
+    try:
+        index_path = Path(index_path)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(index_path, index)
+    except OSError as e:
+        logger.warning(f"無法寫入工作表索引 {index_path}: {e}")
+
+def iter_sheet_analyses(zf, parts, sheets, index=None):
+    """依序產出 (工作表名稱, 分析結果, 是否沿用索引)
+
+    有索引時，(CRC, 大小, 空白共用字串摘要) 相同的工作表直接沿用上次的分析結果，
+    只有內容改變的工作表才會串流重新掃描；共用字串表只在需要時才載入。
+    """
+    strings_part = parts['shared_strings']
+    strings_key = _member_key(zf.getinfo(strings_part)) if strings_part in zf.NameToInfo else None
+    shared_strings = None
+    strings_digest = None
+    if index is not None:
+        if strings_key:
+            entry = index['blank_strings'].get(strings_key)
+            if entry is not None:
+                entry['used'] = time.time()
+                strings_digest = entry['digest']
+        else:
+            strings_digest = _blank_strings_digest([])
+
+    for sheet_name, part in sheets:
+        key = None
+        if index is not None:
+            if strings_digest is None:
+                shared_strings = load_shared_strings(zf, strings_part)
+                strings_digest = _blank_strings_digest(shared_strings)
+                index['blank_strings'][strings_key] = {'digest': strings_digest, 'used': time.time()}
+            key = f"{_member_key(zf.getinfo(part))}:{strings_digest}"
+            entry = index['sheets'].get(key)
+            if entry is not None:
+                entry['used'] = time.time()
+                yield sheet_name, dict(entry['analysis']), True
+                continue
+
+        if shared_strings is None:
+            shared_strings = load_shared_strings(zf, strings_part)
+        analysis = analyze_sheet_part(zf, part, shared_strings, sheet_name)
+        if key is not None:
+            index['sheets'][key] = {'analysis': analysis, 'used': time.time()}
+        yield sheet_name, analysis, False
+
+def check_xlsx_fail_fast(excel_path, index=None, sheet_analyses=None):
+    """快速檢測模式：從最可疑的工作表開始檢查，確認第一個問題即停止
+
+    回傳格式與 analyze_excel() 相同；sheet_analyses 為 dict 時填入已檢查工作表的分析結果
+    """
+    with zipfile.ZipFile(excel_path) as zf:
+        parts = read_workbook_parts(zf)
+        ordered = order_sheets_by_suspicion(zf, parts['sheets'])
+        cell_xfs = load_cell_xfs(zf, parts['styles'])
+
+        logger.info(f"快速檢測模式: 依可疑程度檢查 {len(ordered)} 個工作表")
+        for i, (sheet_name, analysis, _) in enumerate(iter_sheet_analyses(zf, parts, ordered, index), 1):
+            record_sheet(sheet_name, analysis)
+            if sheet_analyses is not None:
+                sheet_analyses[sheet_name] = analysis
+            status = "問題" if analysis['has_size_issue'] else "正常"
+            logger.info(f"  {i:2d}. {status} {sheet_name:<20} - {analysis['reported_rows']:>8,} x {analysis['reported_cols']:>3} 列")
+
+            if analysis['has_size_issue']:
+                logger.debug(f"      實際內容: {analysis['actual_rows']} x {analysis['actual_cols']}")
+                log_phantom_styles(analysis, cell_xfs)
+                logger.info(f"發現問題工作表 {sheet_name}，停止檢查其餘工作表")
+                return {
+                    'success': True,
+                    'has_issues': True,
+                    'file_path': str(excel_path.resolve()),
+                    'issues_count': 1,
+                    'error': None
+                }
+
+    logger.info("所有工作表尺寸都正常，無需修復")
+    return {
+        'success': True,
+        'has_issues': False,
+        'file_path': str(excel_path.resolve()),
+        'issues_count': 0,
+        'error': None
+    }
+
+def _canonical_cell_token(row_idx, col_idx, value, is_date):
+    """將 (座標, 值) 轉為穩定的雜湊輸入
+
+    數字以Excel的15位有效數字比較；日期時間以毫秒比較，
+    因為openpyxl讀寫時會把日期四捨五入到毫秒。
+    """
+    if isinstance(value, bool):
+        token = f"b{int(value)}"
+    elif isinstance(value, (int, float)):
+        token = f"d{round(value * 86400000)}" if is_date else f"n{float(value):.15g}"
+    else:
+        token = f"s{value}"
+    return f"{row_idx},{col_idx}\x1f{token}\x1e".encode('utf-8')
+
+def _iter_real_cell_tokens(zf, part, shared_strings, date_styles):
+    """依XML順序（先行後列）產出所有非空白儲存格的 (行, 列, 雜湊輸入)"""
+    for row_idx, col_idx, value, style_id in iter_sheet_cells(zf, part, shared_strings):
+        if value is not None and str(value).strip():
+            yield row_idx, col_idx, _canonical_cell_token(row_idx, col_idx, value, style_id in date_styles)
+
+def verify_workbook_content(source_path, output_path):
+    """以串流雜湊驗證修復後的檔案保留了來源檔案的每一個實際儲存格
+
+    兩個檔案的同名工作表同步各讀取一次，只保留雜湊狀態與目前的儲存格，
+    記憶體用量與工作表大小無關（共用字串表除外）。
+
+    Returns:
+        list: 每個工作表一筆 {
+            'sheet': str,
+            'match': bool,
+            'source_digest': str, 'output_digest': str,
+            'source_cells': int, 'output_cells': int,
+            'first_mismatch': str or None   # 第一個不一致的儲存格座標
+        }
+    """
+    results = []
+    with zipfile.ZipFile(source_path) as source_zf, zipfile.ZipFile(output_path) as output_zf:
+        source_parts = read_workbook_parts(source_zf)
+        output_parts = read_workbook_parts(output_zf)
+        source_strings = load_shared_strings(source_zf, source_parts['shared_strings'])
+        output_strings = load_shared_strings(output_zf, output_parts['shared_strings'])
+        source_dates = load_date_style_ids(source_zf, source_parts['styles'])
+        output_dates = load_date_style_ids(output_zf, output_parts['styles'])
+        output_sheets = dict(output_parts['sheets'])
+
+        for sheet_name, source_part in source_parts['sheets']:
+            source_cells = _iter_real_cell_tokens(source_zf, source_part, source_strings, source_dates)
+            output_part = output_sheets.get(sheet_name)
+            output_cells = (_iter_real_cell_tokens(output_zf, output_part, output_strings, output_dates)
+                            if output_part else iter(()))
+
+            source_hash = hashlib.sha256()
+            output_hash = hashlib.sha256()
+            source_count = output_count = 0
+            first_mismatch = None
+            for source_cell, output_cell in zip_longest(source_cells, output_cells):
+                if source_cell:
+                    source_hash.update(source_cell[2])
+                    source_count += 1
+                if output_cell:
+                    output_hash.update(output_cell[2])
+                    output_count += 1
+                if first_mismatch is None and source_cell != output_cell:
+                    # 座標較前面的一方就是第一個遺失、多出或值不同的儲存格
+                    candidates = [cell[:2] for cell in (source_cell, output_cell) if cell]
+                    row_idx, col_idx = min(candidates)
+                    first_mismatch = f"{get_column_letter(col_idx)}{row_idx}"
+
+            results.append({
+                'sheet': sheet_name,
+                'match': first_mismatch is None,
+                'source_digest': source_hash.hexdigest(),
+                'output_digest': output_hash.hexdigest(),
+                'source_cells': source_count,
+                'output_cells': output_count,
+                'first_mismatch': first_mismatch,
+            })
+    return results
+
+def verify_fixed_output(source_path, fixed_path):
+    """比對來源與修復後檔案的內容雜湊，回傳不一致的位置清單（例如 ['product!B151']）"""
+    logger.info("驗證修復結果...")
+    mismatches = []
+    for item in verify_workbook_content(source_path, fixed_path):
+        if item['match']:
+            logger.debug(f"  {item['sheet']}: 一致 ({item['source_cells']:,} 個儲存格, {item['source_digest'][:16]})")
+        else:
+            logger.error(f"  {item['sheet']}: 內容不一致，第一個差異位於 {item['first_mismatch']} "
+                         f"(來源 {item['source_cells']:,} / 修復後 {item['output_cells']:,} 個儲存格)")
+            mismatches.append(f"{item['sheet']}!{item['first_mismatch']}")
+    return mismatches
+
+def _deflate_member(data, level):
+    """以raw deflate壓縮一個zip成員（zlib執行時會釋放GIL，可在多執行緒中並行）"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(), zlib.crc32(data) & 0xFFFFFFFF
+
+def _dos_datetime(date_time):
+    """將 (年, 月, 日, 時, 分, 秒) 轉為zip使用的DOS日期與時間"""
+    year, month, day, hour, minute, second = date_time[:6]
+    return ((year - 1980) << 9 | month << 5 | day), (hour << 11 | minute << 5 | second // 2)
+
+def _zip64_extra(*values):
+    """組成ZIP64延伸欄位 (header id 0x0001)，只放入超過32位元限制的欄位"""
+    values = [value for value in values if value is not None]
+    if not values:
+        return b''
+    return struct.pack(f'<HH{len(values)}Q', 0x0001, 8 * len(values), *values)
+
+def write_zip_members(path, members):
+    """寫出一個zip檔，成員資料已事先壓縮好
+
+    成員大小、位移或成員數超過32位元限制時，依zip規格改寫ZIP64延伸欄位與ZIP64結尾記錄。
+
+    Args:
+        members: 依序的 (name, date_time, compress_type, crc, file_size, data)，
+                 data 為已壓縮（或 ZIP_STORED 時為原始）的位元組
+    """
+    central_directory = []
+    with open(path, 'wb') as fp:
+        for name, date_time, compress_type, crc, file_size, data in members:
+            encoded_name = name.encode('utf-8')
+            flag_bits = 0x800 if not name.isascii() else 0
+            dos_date, dos_time = _dos_datetime(date_time)
+            offset = fp.tell()
+            compress_size = len(data)
+
+            # 超過限制的欄位寫入 0xFFFFFFFF，實際數值放在ZIP64延伸欄位；本地檔頭必須同時包含兩個大小
+            large_file = file_size >= ZIP32_LIMIT
+            large_compressed = compress_size >= ZIP32_LIMIT
+            large_offset = offset >= ZIP32_LIMIT
+            local_extra = _zip64_extra(file_size, compress_size) if large_file or large_compressed else b''
+            central_extra = _zip64_extra(file_size if large_file else None,
+                                         compress_size if large_compressed else None,
+                                         offset if large_offset else None)
+            version = zipfile.ZIP64_VERSION if central_extra else 20
+
+            fp.write(struct.pack(zipfile.structFileHeader, zipfile.stringFileHeader, version, 0, flag_bits,
+                                 compress_type, dos_time, dos_date, crc,
+                                 0xFFFFFFFF if local_extra else compress_size,
+                                 0xFFFFFFFF if local_extra else file_size,
+                                 len(encoded_name), len(local_extra)))
+            fp.write(encoded_name)
+            fp.write(local_extra)
+            fp.write(data)
+            central_directory.append(struct.pack(
+                zipfile.structCentralDir, zipfile.stringCentralDir, version, 0, version, 0, flag_bits,
+                compress_type, dos_time, dos_date, crc,
+                0xFFFFFFFF if large_compressed else compress_size,
+                0xFFFFFFFF if large_file else file_size,
+                len(encoded_name), len(central_extra), 0, 0, 0, 0,
+                0xFFFFFFFF if large_offset else offset) + encoded_name + central_extra)
+
+        directory_offset = fp.tell()
+        for entry in central_directory:
+            fp.write(entry)
+        directory_size = fp.tell() - directory_offset
+        entries = len(central_directory)
+        zip64_end = entries >= ZIP32_MAX_ENTRIES or directory_offset >= ZIP32_LIMIT or directory_size >= ZIP32_LIMIT
+        if zip64_end:
+            zip64_end_offset = fp.tell()
+            fp.write(struct.pack(zipfile.structEndArchive64, zipfile.stringEndArchive64,
+                                 zipfile.sizeEndCentDir64 - 12, zipfile.ZIP64_VERSION, zipfile.ZIP64_VERSION,
+                                 0, 0, entries, entries, directory_size, directory_offset))
+            fp.write(struct.pack(zipfile.structEndArchive64Locator, zipfile.stringEndArchive64Locator,
+                                 0, zip64_end_offset, 1))
+        fp.write(struct.pack(zipfile.structEndArchive, zipfile.stringEndArchive, 0, 0,
+                             0xFFFF if zip64_end else entries, 0xFFFF if zip64_end else entries,
+                             0xFFFFFFFF if zip64_end else directory_size,
+                             0xFFFFFFFF if zip64_end else directory_offset, 0))
+
+def save_workbook_parallel(workbook, path, compression='default', workers=None):
+    """儲存活頁簿，各zip成員（工作表、sharedStrings、styles…）以多執行緒平行壓縮
+
+    openpyxl先以不壓縮的方式寫入暫存檔，再由執行緒池平行deflate後組成最終檔案。
+    """
+    level = COMPRESSION_LEVELS[compression]
+    workbook.properties.modified = datetime.now(timezone.utc).replace(tzinfo=None)
+    with tempfile.TemporaryFile() as stored:
+        ExcelWriter(workbook, zipfile.ZipFile(stored, 'w', zipfile.ZIP_STORED, allowZip64=True)).save()
+        stored.seek(0)
+        with zipfile.ZipFile(stored) as archive:
+            infos = archive.infolist()
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+                pending = []
+                for info in infos:
+                    data = archive.read(info)
+                    if len(data) < PARALLEL_COMPRESS_MIN_BYTES:
+                        pending.append((info, len(data), _deflate_member(data, level)))
+                    else:
+                        pending.append((info, len(data), pool.submit(_deflate_member, data, level)))
+
+                def members():
+                    for info, file_size, job in pending:
+                        compressed, crc = job if isinstance(job, tuple) else job.result()
+                        yield info.filename, info.date_time, zipfile.ZIP_DEFLATED, crc, file_size, compressed
+
+                write_zip_members(path, members())
+
 def convert_xls_to_xlsx(xls_path):
     """將.xls檔案轉換為.xlsx格式"""
     logger.info(f"將.xls檔案轉換為.xlsx格式...")
@@ -249,9 +1190,472 @@ def convert_xls_to_xlsx(xls_path):
     logger.info(f"轉換完成: {xlsx_path}")
     return xlsx_path
 
+def _xml_attrs(raw_attrs):
+    """解析標籤屬性為依序的 [(名稱, 值)]（值保持XML跳脫後的原始位元組）"""
+    attrs = []
+    for match in XML_ATTR_RE.finditer(raw_attrs):
+        if match.group(2) is not None:
+            attrs.append((match.group(1), match.group(2)))
+        else:
+            # 單引號屬性改以雙引號輸出
+            attrs.append((match.group(1), match.group(3).replace(b'"', b'&quot;')))
+    return attrs
+
+def _format_attrs(attrs):
+    """將 [(名稱, 值)] 組回屬性字串"""
+    return b''.join(b' ' + name + b'="' + value + b'"' for name, value in attrs)
+
+def _alignment_attrs(alignment):
+    """將openpyxl的Alignment轉為styles.xml的屬性字串"""
+    return ' '.join(f'{key}="{value}"' for key, value in alignment.to_tree().attrib.items())
+
+def _append_style_children(styles_xml, name, items, count):
+    """在styles.xml的 <fonts>/<fills>/<cellXfs> 末端加入新元素並更新count"""
+    match = re.search(r'<((?:\w+:)?)' + name + r'\b([^>]*?)(/?)>', styles_xml)
+    if not match:
+        raise ValueError(f"styles.xml 缺少 <{name}>")
+    prefix, attrs, self_closing = match.groups()
+    attrs = re.sub(r'\s+count="\d*"', '', attrs)
+    start_tag = f'<{prefix}{name}{attrs} count="{count + len(items)}">'
+    body = ''.join(item.format(p=prefix) for item in items)
+    if self_closing:
+        return styles_xml[:match.start()] + start_tag + body + f'</{prefix}{name}>' + styles_xml[match.end():]
+    end = styles_xml.index(f'</{prefix}{name}>', match.end())
+    return styles_xml[:match.start()] + start_tag + styles_xml[match.end():end] + body + styles_xml[end:]
+
+def add_palette_styles(styles_xml, palette_indices):
+    """在styles.xml加入各調色板的標題列與一般列樣式（與 fix_sheet_by_copy() 的風格化相同）
+
+    每種樣式都為原檔用到的每個數字格式各建立一份，重寫後的儲存格可保留日期、百分比等格式。
+
+    Returns:
+        tuple: (新的styles.xml,
+                原 cellXfs 索引 -> numFmtId 的 list,
+                {調色板索引: {(numFmtId, 角色): 新 cellXfs 索引}})  角色 0/1/2 = 第一行/第二行/其他行
+    """
+    root = ET.fromstring(styles_xml)
+    sections = {_local_name(elem.tag): list(elem) for elem in root}
+    source_num_fmts = [int(xf.get('numFmtId', 0)) for xf in sections.get('cellXfs', [])]
+    num_fmt_ids = sorted(set(source_num_fmts) | {0})
+    font_count = len(sections.get('fonts', []))
+    fill_count = len(sections.get('fills', []))
+    xf_count = len(source_num_fmts)
+
+    header_alignment = _alignment_attrs(HEADER_STYLE["alignment"])
+    regular_alignment = _alignment_attrs(REGULAR_CELL_STYLE["alignment"])
+    fonts, fills, xfs = [], [], []
+    palette_xfs = {}
+    for palette_index in palette_indices:
+        palette = COLOR_PALETTES[palette_index % len(COLOR_PALETTES)]
+        fonts.append(f'<{{p}}font><{{p}}color rgb="FF{palette["row1_font"]}"/></{{p}}font>')
+        fonts.append(f'<{{p}}font><{{p}}b/><{{p}}color rgb="FF{palette["row2_font"]}"/></{{p}}font>')
+        for key in ('row1_fill', 'row2_fill'):
+            fills.append(f'<{{p}}fill><{{p}}patternFill patternType="solid"><{{p}}fgColor rgb="FF{palette[key]}"/>'
+                         f'<{{p}}bgColor rgb="FF{palette[key]}"/></{{p}}patternFill></{{p}}fill>')
+        roles = (
+            (font_count + len(fonts) - 2, fill_count + len(fills) - 2, header_alignment),
+            (font_count + len(fonts) - 1, fill_count + len(fills) - 1, header_alignment),
+            (0, 0, regular_alignment),
+        )
+        xf_ids = {}
+        for num_fmt in num_fmt_ids:
+            for role, (font_id, fill_id, alignment) in enumerate(roles):
+                xf_ids[(num_fmt, role)] = xf_count + len(xfs)
+                xfs.append(f'<{{p}}xf numFmtId="{num_fmt}" fontId="{font_id}" fillId="{fill_id}" borderId="0" xfId="0" '
+                           f'applyNumberFormat="1" applyFont="1" applyFill="1" applyAlignment="1">'
+                           f'<{{p}}alignment {alignment}/></{{p}}xf>')
+        palette_xfs[palette_index] = xf_ids
+
+    styles_xml = _append_style_children(styles_xml, 'fonts', fonts, font_count)
+    styles_xml = _append_style_children(styles_xml, 'fills', fills, fill_count)
+    styles_xml = _append_style_children(styles_xml, 'cellXfs', xfs, xf_count)
+    return styles_xml, source_num_fmts, palette_xfs
+
+def _rewrite_sheet_head(head, prefix, safe_rows, safe_cols, styling):
+    """重寫 <sheetData> 之前的部分：更新 <dimension>，風格化時加上標籤顏色並重設欄寬"""
+    p = prefix
+    head = re.sub(rb'(<' + p + rb'dimension\s+ref=")[^"]*(")',
+                  lambda m: m.group(1) + f"A1:{get_column_letter(safe_cols)}{safe_rows}".encode() + m.group(2), head)
+    if styling is None:
+        return head
+
+    tab_color = b'<' + p + b'tabColor rgb="FF' + styling['tab_color'].encode() + b'"/>'
+    head = re.sub(rb'<' + p + rb'tabColor\b[^>]*/>', b'', head)
+    sheet_pr = re.search(rb'<' + p + rb'sheetPr\b([^>]*?)(/?)>', head)
+    if sheet_pr and sheet_pr.group(2):
+        head = (head[:sheet_pr.start()] + b'<' + p + b'sheetPr' + sheet_pr.group(1) + b'>' + tab_color
+                + b'</' + p + b'sheetPr>' + head[sheet_pr.end():])
+    elif sheet_pr:
+        head = head[:sheet_pr.end()] + tab_color + head[sheet_pr.end():]
+    else:
+        worksheet = re.search(rb'<' + p + rb'worksheet\b[^>]*>', head)
+        head = head[:worksheet.end()] + b'<' + p + b'sheetPr>' + tab_color + b'</' + p + b'sheetPr>' + head[worksheet.end():]
+
+    head = re.sub(rb'<' + p + rb'cols\b.*?</' + p + rb'cols>|<' + p + rb'cols\b[^>]*/>', b'', head, flags=re.S)
+    return head + (b'<' + p + b'cols><' + p + b'col min="1" max="' + str(safe_cols).encode()
+                   + b'" width="15" customWidth="1"/></' + p + b'cols>')
+
+def rewrite_sheet_part(source_path, part, actual_rows, actual_cols, styling, output_path, level):
+    """串流重寫一個工作表XML，只保留真實範圍內的行列，結果直接deflate寫入暫存檔
+
+    在工作程序中執行，各工作表可同時處理。儲存格內容原封不動保留，
+    sharedStrings.xml 不需要變更。
+
+    Args:
+        styling: None 表示保留原有格式；風格化時為 {
+            'tab_color': str, 'num_fmts': list, 'xf_ids': {(numFmtId, 角色): cellXfs 索引}
+        }
+
+    Returns:
+        dict: {'crc', 'file_size', 'compress_size', 'rows_written', 'cells_created', 'style_assignments'}
+    """
+    # 與 fix_sheet_by_copy() 相同，至少保留 10 x 10
+    safe_rows = max(actual_rows, 10) if actual_rows > 0 else 10
+    safe_cols = max(actual_cols, 10) if actual_cols > 0 else 10
+    stats = {'crc': 0, 'file_size': 0, 'compress_size': 0,
+             'rows_written': 0, 'cells_created': 0, 'style_assignments': 0}
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    with zipfile.ZipFile(source_path) as zf, zf.open(part) as source, open(output_path, 'wb') as output:
+        def emit(data):
+            stats['crc'] = zlib.crc32(data, stats['crc'])
+            stats['file_size'] += len(data)
+            output.write(compressor.compress(data))
+
+        def cell_style(row_idx, source_style):
+            role = 0 if row_idx == 1 else 1 if row_idx == 2 else 2
+            num_fmts = styling['num_fmts']
+            num_fmt = num_fmts[source_style] if source_style < len(num_fmts) else 0
+            stats['style_assignments'] += 1
+            return str(styling['xf_ids'].get((num_fmt, role), styling['xf_ids'][(0, role)])).encode()
+
+        def emit_row(prefix, row_idx, row_attrs, cells):
+            if styling is None:
+                attrs = [(name, value) for name, value in row_attrs if name != b'spans']
+            else:
+                attrs = [(b'r', str(row_idx).encode()), (b'ht', str(REGULAR_CELL_STYLE["height"] if row_idx > 2
+                                                                      else HEADER_STYLE["height"]).encode()),
+                         (b'customHeight', b'1')]
+            parts = [b'<' + prefix + b'row' + _format_attrs(attrs) + b'>']
+            next_col = 1
+            for col_idx, cell_attrs, inner in cells:
+                if styling is not None:
+                    # 風格化時與 fix_sheet_by_copy() 一樣，範圍內每一格都要建立
+                    for empty_col in range(next_col, col_idx):
+                        parts.append(b'<' + prefix + b'c r="' + f"{get_column_letter(empty_col)}{row_idx}".encode()
+                                     + b'" s="' + cell_style(row_idx, 0) + b'"/>')
+                        stats['cells_created'] += 1
+                    source_style = next((int(value) for name, value in cell_attrs if name == b's'), 0)
+                    cell_attrs = [(name, value) for name, value in cell_attrs if name != b's']
+                    cell_attrs.append((b's', cell_style(row_idx, source_style)))
+                attrs = [(b'r', f"{get_column_letter(col_idx)}{row_idx}".encode())]
+                attrs += [(name, value) for name, value in cell_attrs if name != b'r']
+                if inner is None:
+                    parts.append(b'<' + prefix + b'c' + _format_attrs(attrs) + b'/>')
+                else:
+                    parts.append(b'<' + prefix + b'c' + _format_attrs(attrs) + b'>' + inner + b'</' + prefix + b'c>')
+                stats['cells_created'] += 1
+                next_col = col_idx + 1
+            if styling is not None:
+                for empty_col in range(next_col, safe_cols + 1):
+                    parts.append(b'<' + prefix + b'c r="' + f"{get_column_letter(empty_col)}{row_idx}".encode()
+                                 + b'" s="' + cell_style(row_idx, 0) + b'"/>')
+                    stats['cells_created'] += 1
+            parts.append(b'</' + prefix + b'row>')
+            emit(b''.join(parts))
+            stats['rows_written'] += 1
+
+        def emit_missing_rows(prefix, start, stop):
+            # 風格化時範圍內缺少的行也要補上（設定行高與樣式）
+            if styling is None:
+                return
+            for row_idx in range(start, stop):
+                emit_row(prefix, row_idx, [], [])
+
+        buffer = b''
+        eof = False
+        def fill():
+            nonlocal buffer, eof
+            chunk = source.read(STREAM_CHUNK_BYTES)
+            if chunk:
+                buffer += chunk
+            else:
+                eof = True
+            return bool(chunk)
+
+        # 1. <sheetData> 之前：尺寸、標籤顏色、欄寬
+        match = SHEET_DATA_START_RE.search(buffer)
+        while not match and fill():
+            match = SHEET_DATA_START_RE.search(buffer)
+        if not match:
+            raise ValueError(f"{part} 缺少 <sheetData>")
+        prefix = match.group(1)
+        emit(_rewrite_sheet_head(buffer[:match.start()], prefix, safe_rows, safe_cols, styling))
+        emit(b'<' + prefix + b'sheetData' + match.group(2) + b'>')
+        data_end = b'</' + prefix + b'sheetData>'
+        buffer = buffer[match.end():]
+
+        # 2. 逐行處理 <sheetData>，超出範圍後的幽靈行不解析直接略過
+        next_row = 1
+        if not match.group(3):
+            pos = 0
+            while True:
+                row_match = ROW_START_RE.search(buffer, pos)
+                end_pos = buffer.find(data_end, pos, row_match.start() if row_match else len(buffer))
+                if row_match and end_pos < 0:
+                    if row_match.group(3):
+                        row_end = row_match.end()
+                        body = b''
+                    else:
+                        close_tag = b'</' + prefix + b'row>'
+                        close_pos = buffer.find(close_tag, row_match.end())
+                        if close_pos < 0:
+                            buffer = buffer[row_match.start():]
+                            pos = 0
+                            if not fill():
+                                raise ValueError(f"{part} 的XML不完整")
+                            continue
+                        row_end = close_pos + len(close_tag)
+                        body = buffer[row_match.end():close_pos]
+
+                    row_attrs = _xml_attrs(row_match.group(2))
+                    row_ref = next((value for name, value in row_attrs if name == b'r'), None)
+                    row_idx = int(row_ref) if row_ref else next_row
+                    if row_idx > safe_rows:
+                        buffer = buffer[row_end:]
+                        break
+
+                    cells = []
+                    col_idx = 0
+                    for cell_match in CELL_RE.finditer(body):
+                        cell_attrs = _xml_attrs(cell_match.group(2))
+                        ref = next((value for name, value in cell_attrs if name == b'r'), None)
+                        col_idx = split_cell_ref(ref.decode('ascii'))[1] if ref else col_idx + 1
+                        if col_idx <= safe_cols:
+                            cells.append((col_idx, cell_attrs, cell_match.group(3)))
+
+                    emit_missing_rows(prefix, next_row, row_idx)
+                    emit_row(prefix, row_idx, row_attrs, cells)
+                    next_row = row_idx + 1
+                    pos = row_end
+                    if pos > STREAM_CHUNK_BYTES:
+                        buffer = buffer[pos:]
+                        pos = 0
+                elif end_pos >= 0:
+                    buffer = buffer[end_pos:]
+                    break
+                else:
+                    buffer = buffer[pos:]
+                    pos = 0
+                    if not fill():
+                        raise ValueError(f"{part} 的XML不完整")
+
+            # 略過剩餘的幽靈行直到 </sheetData>
+            end_pos = buffer.find(data_end)
+            while end_pos < 0:
+                buffer = buffer[-len(data_end):]
+                if not fill():
+                    raise ValueError(f"{part} 的XML不完整")
+                end_pos = buffer.find(data_end)
+            buffer = buffer[end_pos + len(data_end):]
+
+        emit_missing_rows(prefix, next_row, safe_rows + 1)
+        emit(data_end)
+
+        # 3. </sheetData> 之後（合併儲存格、頁面設定、繪圖等）原樣保留
+        emit(buffer)
+        buffer = b''
+        while fill():
+            emit(buffer)
+            buffer = b''
+
+        output.write(compressor.flush())
+    stats['compress_size'] = os.path.getsize(output_path)
+    return stats
+
+def read_raw_member(fp, info):
+    """直接讀取zip成員壓縮後的原始資料，複製到新檔案時不需解壓再壓縮"""
+    fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, fp.read(zipfile.sizeFileHeader))
+    # 本地檔頭最後兩個欄位為檔名長度與額外欄位長度
+    fp.seek(info.header_offset + zipfile.sizeFileHeader + header[-2] + header[-1])
+    return fp.read(info.compress_size)
+
+def plan_package_prune(zf, strip_pivot_records=False, strip_calc_chain=False):
+    """從套件根關聯 (_rels/.rels) 沿著 .rels 走訪，找出可移除的zip成員
+
+    沒有任何關聯指向的成員（例如未使用的 xl/media 圖片）一律移除；
+    strip_pivot_records / strip_calc_chain 時另外切斷指向樞紐分析快取記錄與
+    calcChain.xml 的關聯（Excel 重新整理或重新計算時會自行重建）。
+
+    Returns:
+        dict: {
+            'removed': {成員名稱: (原因, 壓縮後位元組數)},
+            'replaced': {成員名稱: 新內容bytes}   # 需同步修改的 .rels、[Content_Types].xml、樞紐分析快取定義
+        }
+    """
+    strip_types = tuple(rel_type for rel_type, enabled in (
+        (REL_TYPE_PIVOT_CACHE_RECORDS, strip_pivot_records),
+        (REL_TYPE_CALC_CHAIN, strip_calc_chain)) if enabled)
+    # OPC 的part名稱不分大小寫
+    names = {name.lower(): name for name in zf.namelist() if not name.endswith('/')}
+
+    reachable = {CONTENT_TYPES_PART}
+    stripped = {}    # 被切斷的目標成員 -> 關聯類型字尾
+    cut_edges = {}   # 來源part -> [(rId, 關聯類型字尾), ...]
+    pending = ['']
+    while pending:
+        part = pending.pop()
+        rels_name = names.get(_rels_path(part).lower())
+        if rels_name is None:
+            continue
+        reachable.add(rels_name)
+        for rel_id, (rel_type, target, mode) in _read_rels(zf, part).items():
+            name = names.get(target.lower()) if mode != 'External' else None
+            if name is None:
+                continue
+            strip_type = next((suffix for suffix in strip_types if rel_type.endswith(suffix)), None)
+            if strip_type:
+                cut_edges.setdefault(part, []).append((rel_id, strip_type))
+                stripped[name] = strip_type
+            elif name not in reachable:
+                reachable.add(name)
+                pending.append(name)
+
+    removed = {}
+    for name in names.values():
+        if name not in reachable:
+            reason = PRUNE_REASONS[stripped[name]] if name in stripped else "沒有任何關聯參照"
+            removed[name] = (reason, zf.getinfo(name).compress_size)
+
+    replaced = {}
+    for part, edges in cut_edges.items():
+        rel_ids = {rel_id.encode('utf-8') for rel_id, _ in edges}
+        rels_name = names[_rels_path(part).lower()]
+        replaced[rels_name] = RELATIONSHIP_TAG_RE.sub(
+            lambda m: b'' if dict(_xml_attrs(m.group(2))).get(b'Id') in rel_ids else m.group(0),
+            zf.read(rels_name))
+        if any(strip_type == REL_TYPE_PIVOT_CACHE_RECORDS for _, strip_type in edges):
+            replaced[part] = _refresh_pivot_cache_on_load(zf.read(part), rel_ids)
+
+    if removed and CONTENT_TYPES_PART in zf.NameToInfo:
+        removed_lower = {name.lower() for name in removed}
+        def keep_override(match):
+            part_name = dict(_xml_attrs(match.group(2))).get(b'PartName', b'')
+            return b'' if unquote(part_name.decode('utf-8')).lstrip('/').lower() in removed_lower else match.group(0)
+        replaced[CONTENT_TYPES_PART] = OVERRIDE_TAG_RE.sub(keep_override, zf.read(CONTENT_TYPES_PART))
+
+    return {'removed': removed, 'replaced': replaced}
+
+def _refresh_pivot_cache_on_load(definition_xml, record_ids):
+    """移除樞紐分析快取定義指向記錄的 r:id，並設定 refreshOnLoad 讓Excel開啟時重建"""
+    match = PIVOT_CACHE_DEFINITION_RE.search(definition_xml)
+    if not match:
+        return definition_xml
+    prefix, raw_attrs = match.groups()
+    attrs = [(name, value) for name, value in _xml_attrs(raw_attrs)
+             if not (name.endswith(b':id') and value in record_ids) and name != b'refreshOnLoad']
+    attrs.append((b'refreshOnLoad', b'1'))
+    return (definition_xml[:match.start()] + b'<' + prefix + b'pivotCacheDefinition' + _format_attrs(attrs) + b'>'
+            + definition_xml[match.end():])
+
+def log_prune_plan(plan):
+    """列出每個被移除的zip成員與節省的位元組數"""
+    saved = sum(size for _, size in plan['removed'].values())
+    logger.info(f"可清理 {len(plan['removed'])} 個zip成員，節省 {saved / 1024 / 1024:.2f} MB:")
+    for name, (reason, size) in sorted(plan['removed'].items(), key=lambda item: -item[1][1]):
+        logger.info(f"  • {name} ({reason}): {size / 1024:,.1f} KB")
+
+def fix_workbook_streaming(excel_path, fixed_path, problem_sheets, apply_styling=True, compression='default', jobs=None,
+                           prune_plan=None):
+    """平行重寫多個問題工作表並組成修復後的檔案
+
+    每個問題工作表在獨立的工作程序中從來源zip串流重寫為暫存檔，
+    其餘zip成員原樣複製（不重新壓縮），最後依原順序組合，
+    總時間取決於最大的工作表而非所有工作表的總和。
+
+    Args:
+        problem_sheets: [(工作表名稱, 分析結果), ...]
+        prune_plan: plan_package_prune() 的結果，略過要移除的成員並寫入修改後的關聯檔
+    """
+    level = COMPRESSION_LEVELS[compression]
+    with zipfile.ZipFile(excel_path) as zf:
+        parts = read_workbook_parts(zf)
+        sheet_parts = dict(parts['sheets'])
+        styles_part = parts['styles']
+
+        styles_xml = None
+        stylings = {}
+        if apply_styling and styles_part and problem_sheets:
+            palette_indices = range(len(problem_sheets))
+            styles_xml, num_fmts, palette_xfs = add_palette_styles(zf.read(styles_part).decode('utf-8'), palette_indices)
+            for palette_index in palette_indices:
+                stylings[palette_index] = {
+                    'tab_color': COLOR_PALETTES[palette_index % len(COLOR_PALETTES)]["sheet_tab_color"],
+                    'num_fmts': num_fmts,
+                    'xf_ids': palette_xfs[palette_index],
+                }
+
+        with tempfile.TemporaryDirectory(dir=Path(fixed_path).parent) as temp_dir:
+            tasks = []
+            for palette_index, (sheet_name, analysis) in enumerate(problem_sheets):
+                part = sheet_parts[sheet_name]
+                temp_path = os.path.join(temp_dir, f"sheet{palette_index}.deflate")
+                tasks.append((sheet_name, part, temp_path, (
+                    str(excel_path), part, analysis['actual_rows'], analysis['actual_cols'],
+                    stylings.get(palette_index), temp_path, level)))
+
+            workers = min(jobs or os.cpu_count() or 1, len(tasks))
+            rewritten = {}
+            if workers <= 1:
+                for sheet_name, part, temp_path, args in tasks:
+                    logger.info(f"修復 {sheet_name}...")
+                    rewritten[part] = (temp_path, rewrite_sheet_part(*args))
+            else:
+                logger.info(f"以 {workers} 個工作程序平行修復 {len(tasks)} 個工作表...")
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [(part, temp_path, pool.submit(rewrite_sheet_part, *args))
+                               for _, part, temp_path, args in tasks]
+                    for part, temp_path, future in futures:
+                        rewritten[part] = (temp_path, future.result())
+
+            for sheet_name, part, _, _ in tasks:
+                stats = rewritten[part][1]
+                count_profile(sheet_name, cells_created=stats['cells_created'], rows_written=stats['rows_written'],
+                              style_assignments=stats['style_assignments'])
+
+            def members():
+                with open(excel_path, 'rb') as source:
+                    for info in zf.infolist():
+                        if prune_plan and info.filename in prune_plan['removed']:
+                            continue
+                        if info.filename in rewritten:
+                            temp_path, stats = rewritten[info.filename]
+                            with open(temp_path, 'rb') as fp:
+                                data = fp.read()
+                            yield (info.filename, info.date_time, zipfile.ZIP_DEFLATED,
+                                   stats['crc'] & 0xFFFFFFFF, stats['file_size'], data)
+                        elif info.filename == styles_part and styles_xml is not None:
+                            raw = styles_xml.encode('utf-8')
+                            data, crc = _deflate_member(raw, level)
+                            yield info.filename, info.date_time, zipfile.ZIP_DEFLATED, crc, len(raw), data
+                        elif prune_plan and info.filename in prune_plan['replaced']:
+                            raw = prune_plan['replaced'][info.filename]
+                            data, crc = _deflate_member(raw, level)
+                            yield info.filename, info.date_time, zipfile.ZIP_DEFLATED, crc, len(raw), data
+                        else:
+                            yield (info.filename, info.date_time, info.compress_type, info.CRC,
+                                   info.file_size, read_raw_member(source, info))
+
+            write_zip_members(fixed_path, members())
+
+def sibling_path(path, tag):
+    """在原副檔名前加上標記（.xlsm 仍是 .xlsm，Excel 才會接受啟用巨集的內容類型）"""
+    return path.with_name(f"{path.stem}.{tag}{path.suffix}")
+
 def backup_file(original_path):
     """建立備份檔案"""
-    backup_path = original_path.with_suffix(f'.backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx')
+    backup_path = sibling_path(original_path, f'backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
     shutil.copy2(original_path, backup_path)
     return backup_path
 
@@ -286,6 +1690,9 @@ def fix_sheet_by_copy(workbook, sheet_name, actual_rows, actual_cols, apply_styl
                                end_color=palette["row2_fill"], 
                                fill_type="solid")
     
+    cells_created = 0
+    style_assignments = 0
+    
     # 複製實際有內容的資料
     for row_idx in range(1, safe_rows + 1):
         # 設定行高
@@ -299,6 +1706,7 @@ def fix_sheet_by_copy(workbook, sheet_name, actual_rows, actual_cols, apply_styl
             try:
                 old_cell = old_sheet.cell(row=row_idx, column=col_idx)
                 new_cell = new_sheet.cell(row=row_idx, column=col_idx)
+                cells_created += 1
                 
                 # 複製值
                 new_cell.value = old_cell.value
@@ -309,20 +1717,25 @@ def fix_sheet_by_copy(workbook, sheet_name, actual_rows, actual_cols, apply_styl
                         new_cell.font = row1_font
                         new_cell.fill = row1_fill
                         new_cell.alignment = HEADER_STYLE["alignment"]
+                        style_assignments += 3
                     elif row_idx == 2:  # 第二行 - 深色背景樣式
                         new_cell.font = row2_font
                         new_cell.fill = row2_fill
                         new_cell.alignment = HEADER_STYLE["alignment"]
+                        style_assignments += 3
                     else:  # 其他行 - 一般樣式
                         new_cell.alignment = REGULAR_CELL_STYLE["alignment"]
+                        style_assignments += 1
                 else:
                     # 複製原有基本格式
                     if hasattr(old_cell, 'font') and old_cell.font:
                         if old_cell.font.bold:
                             new_cell.font = Font(bold=True)
+                            style_assignments += 1
                     if hasattr(old_cell, 'alignment') and old_cell.alignment:
                         if old_cell.alignment.horizontal:
                             new_cell.alignment = Alignment(horizontal=old_cell.alignment.horizontal)
+                            style_assignments += 1
             except Exception as e:
                 # 如果某個儲存格複製失敗，跳過並繼續
                 continue
@@ -333,6 +1746,9 @@ def fix_sheet_by_copy(workbook, sheet_name, actual_rows, actual_cols, apply_styl
             col_letter = get_column_letter(col)
             new_sheet.column_dimensions[col_letter].width = 15
     
+    count_profile(sheet_name, cells_created=cells_created, rows_written=safe_rows,
+                  style_assignments=style_assignments)
+    
     # 獲取原工作表位置
     old_index = workbook.sheetnames.index(sheet_name)
     
@@ -343,8 +1759,23 @@ def fix_sheet_by_copy(workbook, sheet_name, actual_rows, actual_cols, apply_styl
     
     return True
 
-def analyze_excel(file_path, fix_issues=False):
+def analyze_excel(file_path, fix_issues=False, fail_fast=False, verify=False, compression='default', jobs=None,
+                  index_path=DEFAULT_STORE, prune=False, strip_pivot_records=False, strip_calc_chain=False,
+                  sheet_analyses=None):
     """分析Excel檔案
+
+    Args:
+        file_path: Excel檔案路徑
+        fix_issues: 是否修復發現的問題
+        fail_fast: 僅檢測時，確認第一個問題工作表即停止（issues_count 最多為 1）
+        verify: 修復後驗證每個實際儲存格都被保留，不一致時視為失敗
+        compression: 修復檔案的壓縮等級 'fast'、'default' 或 'max'
+        jobs: 平行修復工作表的工作程序數量（預設為CPU核心數）
+        index_path: 工作表分析索引檔路徑，內容未變動的工作表沿用上次結果（None 表示停用）
+        prune: 修復時移除沒有任何關聯參照的zip成員（僅.xlsx）
+        strip_pivot_records: 一併移除樞紐分析快取記錄（隱含 prune）
+        strip_calc_chain: 一併移除 calcChain.xml（隱含 prune）
+        sheet_analyses: 傳入 dict 時填入已分析的 {工作表名稱: 分析結果}（僅.xlsx），供匯出沿用
     
     Returns:
         dict: {
@@ -380,6 +1811,7 @@ def analyze_excel(file_path, fix_issues=False):
         if is_xls_file:
             # 處理.xls檔案 - 先分析原檔案，如果需要修復則轉換
             logger.info("偵測到.xls格式檔案，正在分析...")
+            analyze_started = time.perf_counter()
             xls_workbook = xlrd.open_workbook(excel_path)
             
             logger.info(f"工作表列表 ({xls_workbook.nsheets} 個):")
@@ -388,8 +1820,12 @@ def analyze_excel(file_path, fix_issues=False):
             total_issues = 0
             
             for i, sheet_name in enumerate(xls_workbook.sheet_names(), 1):
+                if fail_fast and not fix_issues and problem_sheets:
+                    logger.info("快速檢測模式: 已發現問題工作表，停止檢查其餘工作表")
+                    break
                 sheet = xls_workbook.sheet_by_name(sheet_name)
                 analysis = analyze_xls_sheet_size(sheet)
+                record_sheet(sheet_name, analysis)
                 
                 status = "問題" if analysis['has_size_issue'] else "正常"
                 logger.info(f"  {i:2d}. {status} {sheet_name:<20} - {analysis['reported_rows']:>8,} x {analysis['reported_cols']:>3} 列")
@@ -410,6 +1846,7 @@ def analyze_excel(file_path, fix_issues=False):
                     elif col_issue:
                         logger.debug(f"      空白列問題: 多了 {analysis['reported_cols'] - analysis['actual_cols']} 列")
             
+            record_stage('analyze', time.perf_counter() - analyze_started)
             if problem_sheets:
                 logger.info(f"發現 {total_issues} 個工作表有尺寸問題:")
                 for sheet_name, analysis in problem_sheets:
@@ -430,6 +1867,7 @@ def analyze_excel(file_path, fix_issues=False):
                 logger.info("注意: .xls檔案修復將轉換為.xlsx格式")
                 
                 # 轉換為.xlsx格式
+                fix_started = time.perf_counter()
                 converted_file = convert_xls_to_xlsx(excel_path)
                 workbook = openpyxl.load_workbook(converted_file)
                 
@@ -446,13 +1884,29 @@ def analyze_excel(file_path, fix_issues=False):
                 
                 # 儲存修復後的檔案
                 fixed_path = excel_path.with_suffix('.fixed.xlsx')
-                workbook.save(fixed_path)
+                save_workbook_parallel(workbook, fixed_path, compression)
+                record_part_bytes(fixed_path, 'bytes_written')
+                workbook.close()
+                record_stage('fix', time.perf_counter() - fix_started)
+                
+                mismatches = []
+                if verify:
+                    verify_started = time.perf_counter()
+                    mismatches = verify_fixed_output(converted_file, fixed_path)
+                    record_stage('verify', time.perf_counter() - verify_started)
+                if mismatches:
+                    return {
+                        'success': False,
+                        'has_issues': True,
+                        'file_path': str(fixed_path.resolve()),
+                        'issues_count': len(problem_sheets),
+                        'error': f"修復驗證失敗: {', '.join(mismatches)}"
+                    }
                 
                 logger.info("修復完成!")
                 logger.debug(f"修復後檔案: {fixed_path}")
                 logger.debug(f"檔案大小: {fixed_path.stat().st_size / 1024 / 1024:.2f} MB")
                 
-                workbook.close()
                 return {
                     'success': True,
                     'has_issues': True,
@@ -473,18 +1927,35 @@ def analyze_excel(file_path, fix_issues=False):
             }
             
         else:
-            # 處理.xlsx檔案 - 原有邏輯
-            workbook = openpyxl.load_workbook(excel_path)
+            # 處理.xlsx檔案 - 直接串流讀取各工作表XML，內容未變動的工作表沿用索引
+            analyze_started = time.perf_counter()
+            index_path = resolve_store_path(index_path, SHEET_INDEX_FILENAME, '工作表分析索引')
+            index = load_sheet_index(index_path) if index_path else None
+            if fail_fast and not fix_issues:
+                result = check_xlsx_fail_fast(excel_path, index, sheet_analyses)
+                record_stage('analyze', time.perf_counter() - analyze_started)
+                if index is not None:
+                    save_sheet_index(index, index_path)
+                return result
+
+            with zipfile.ZipFile(excel_path) as zf:
+                parts = read_workbook_parts(zf)
+                analyses = list(iter_sheet_analyses(zf, parts, parts['sheets'], index))
+                cell_xfs = load_cell_xfs(zf, parts['styles'])
+            if index is not None:
+                reused = sum(1 for _, _, cached in analyses if cached)
+                logger.debug(f"工作表索引: 沿用 {reused} 個，重新掃描 {len(analyses) - reused} 個")
+                save_sheet_index(index, index_path)
             
-            logger.info(f"工作表列表 ({len(workbook.sheetnames)} 個):")
+            logger.info(f"工作表列表 ({len(analyses)} 個):")
             
             problem_sheets = []
             total_issues = 0
             
-            for i, sheet_name in enumerate(workbook.sheetnames, 1):
-                sheet = workbook[sheet_name]
-                analysis = analyze_sheet_size(sheet)
-                
+            for i, (sheet_name, analysis, _) in enumerate(analyses, 1):
+                record_sheet(sheet_name, analysis)
+                if sheet_analyses is not None:
+                    sheet_analyses[sheet_name] = analysis
                 status = "問題" if analysis['has_size_issue'] else "正常"
                 logger.info(f"  {i:2d}. {status} {sheet_name:<20} - {analysis['reported_rows']:>8,} x {analysis['reported_cols']:>3} 列")
                 
@@ -503,7 +1974,9 @@ def analyze_excel(file_path, fix_issues=False):
                         logger.debug(f"      空白行問題: 多了 {analysis['reported_rows'] - analysis['actual_rows']:,} 行")
                     elif col_issue:
                         logger.debug(f"      空白列問題: 多了 {analysis['reported_cols'] - analysis['actual_cols']} 列")
+                    log_phantom_styles(analysis, cell_xfs)
             
+            record_stage('analyze', time.perf_counter() - analyze_started)
             if problem_sheets:
                 logger.info(f"發現 {total_issues} 個工作表有尺寸問題:")
                 for sheet_name, analysis in problem_sheets:
@@ -519,30 +1992,49 @@ def analyze_excel(file_path, fix_issues=False):
                     else:
                         logger.info(f"  • {sheet_name}: 尺寸異常")
             
-            if fix_issues and problem_sheets:
+            prune_plan = None
+            if prune or strip_pivot_records or strip_calc_chain:
+                prune_started = time.perf_counter()
+                with zipfile.ZipFile(excel_path) as zf:
+                    prune_plan = plan_package_prune(zf, strip_pivot_records, strip_calc_chain)
+                record_stage('analyze', time.perf_counter() - prune_started)
+                if prune_plan['removed']:
+                    log_prune_plan(prune_plan)
+            pruned = bool(prune_plan and prune_plan['removed'])
+            
+            if fix_issues and (problem_sheets or pruned):
                 logger.info("開始修復問題...")
                 
                 # 建立備份
                 backup_path = backup_file(excel_path)
                 logger.info(f"已建立備份: {backup_path.name}")
                 
-                # 修復問題工作表
-                palette_idx = 0
-                for sheet_name, analysis in problem_sheets:
-                    logger.info(f"修復 {sheet_name}...")
-                    fix_sheet_by_copy(workbook, sheet_name, analysis['actual_rows'], analysis['actual_cols'], True, palette_idx)
-                    palette_idx += 1
+                # 各問題工作表平行串流重寫，直接組成修復後的檔案
+                fix_started = time.perf_counter()
+                fixed_path = sibling_path(excel_path, 'fixed')
+                fix_workbook_streaming(excel_path, fixed_path, problem_sheets, True, compression, jobs, prune_plan)
+                record_part_bytes(fixed_path, 'bytes_written')
+                record_stage('fix', time.perf_counter() - fix_started)
                 
-                # 儲存修復後的檔案
-                fixed_path = excel_path.with_suffix('.fixed.xlsx')
-                workbook.save(fixed_path)
+                mismatches = []
+                if verify:
+                    verify_started = time.perf_counter()
+                    mismatches = verify_fixed_output(excel_path, fixed_path)
+                    record_stage('verify', time.perf_counter() - verify_started)
+                if mismatches:
+                    return {
+                        'success': False,
+                        'has_issues': True,
+                        'file_path': str(fixed_path.resolve()),
+                        'issues_count': len(problem_sheets),
+                        'error': f"修復驗證失敗: {', '.join(mismatches)}"
+                    }
                 
                 logger.info("修復完成!")
                 logger.debug(f"修復後檔案: {fixed_path}")
                 logger.debug(f"檔案大小: {fixed_path.stat().st_size / 1024 / 1024:.2f} MB")
                 logger.debug(f"節省空間: {(excel_path.stat().st_size - fixed_path.stat().st_size) / 1024 / 1024:.2f} MB")
                 
-                workbook.close()
                 return {
                     'success': True,
                     'has_issues': True,
@@ -554,7 +2046,6 @@ def analyze_excel(file_path, fix_issues=False):
             elif not problem_sheets:
                 logger.info("所有工作表尺寸都正常，無需修復")
             
-            workbook.close()
             return {
                 'success': True,
                 'has_issues': len(problem_sheets) > 0,
@@ -573,6 +2064,1011 @@ def analyze_excel(file_path, fix_issues=False):
             'error': str(e)
         }
 
+def iter_sheet_rows(zf, part, shared_strings, max_rows, max_cols, date_styles=(), epoch=CALENDAR_WINDOWS_1900):
+    """依序產出 1..max_rows 每一行的值（長度固定為 max_cols），超出範圍的幽靈行不會被讀取
+
+    使用日期格式 (date_styles) 的數字儲存格轉為 datetime/time，與openpyxl讀取結果相同
+    """
+    values = None
+    current_row = 0
+    for row_idx, col_idx, value, style_id in iter_sheet_cells(zf, part, shared_strings, formulas=False):
+        if row_idx > max_rows:
+            break
+        if style_id in date_styles and isinstance(value, (int, float)) and not isinstance(value, bool):
+            try:
+                value = from_excel(value, epoch)
+            except (OverflowError, ValueError):
+                pass  # 超出日期範圍的序號保留原始數字
+        if row_idx != current_row:
+            if values is not None:
+                yield values
+            for _ in range(current_row + 1, row_idx):
+                yield [None] * max_cols
+            values = [None] * max_cols
+            current_row = row_idx
+        if col_idx <= max_cols:
+            values[col_idx - 1] = value
+    if values is not None:
+        yield values
+    for _ in range(current_row + 1, max_rows + 1):
+        yield [None] * max_cols
+
+def _export_csv(rows, output_path):
+    """逐行寫出CSV"""
+    with open(output_path, 'w', newline='', encoding='utf-8') as fp:
+        writer = csv.writer(fp)
+        for values in rows:
+            writer.writerow(['' if value is None else value for value in values])
+
+def _export_parquet(rows, output_path, max_cols):
+    """分批寫出Parquet，每批 EXPORT_BATCH_ROWS 行"""
+    # Excel同一欄常混雜數字與文字，統一存為字串欄位，欄名使用欄位字母
+    schema = pa.schema([(get_column_letter(col), pa.string()) for col in range(1, max_cols + 1)])
+    with pq.ParquetWriter(str(output_path), schema) as writer:
+        batch = []
+        for values in rows:
+            batch.append(values)
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                writer.write_table(_parquet_table(batch, schema))
+                batch = []
+        if batch:
+            writer.write_table(_parquet_table(batch, schema))
+
+def _parquet_table(batch, schema):
+    """將一批行轉為Arrow表格"""
+    columns = [
+        pa.array([None if values[col] is None else str(values[col]) for values in batch], pa.string())
+        for col in range(len(schema))
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def export_workbook(excel_path, export_format, output_dir=None, sheet_names=None, analyses=None):
+    """將各工作表的真實資料範圍串流匯出為 CSV 或 Parquet，不經過中間的xlsx檔
+
+    每個工作表只讀取真實範圍內的行寫出，日期儲存格輸出為日期時間而非序號；
+    記憶體用量固定（Parquet 為每批 EXPORT_BATCH_ROWS 行）。
+    analyses 為 analyze_excel() 已取得的 {工作表名稱: 分析結果}，其中沒有的工作表才重新串流分析。
+
+    Returns:
+        list: 匯出的檔案路徑
+    """
+    excel_path = Path(excel_path)
+    if excel_path.suffix.lower() == '.xls':
+        raise ValueError("匯出僅支援 .xlsx 格式")
+    if export_format == 'parquet' and pa is None:
+        raise ImportError("匯出 Parquet 需要安裝 pyarrow")
+
+    output_dir = Path(output_dir) if output_dir else excel_path.parent
+    output_dir.mkdir(parents=True, exist_ok=True)
+    suffix = '.csv' if export_format == 'csv' else '.parquet'
+
+    exported = []
+    with zipfile.ZipFile(excel_path) as zf:
+        parts = read_workbook_parts(zf)
+        shared_strings = load_shared_strings(zf, parts['shared_strings'])
+        date_styles = load_date_style_ids(zf, parts['styles'])
+        epoch = CALENDAR_MAC_1904 if parts['date1904'] else CALENDAR_WINDOWS_1900
+        available = dict(parts['sheets'])
+        if sheet_names:
+            missing = [name for name in sheet_names if name not in available]
+            if missing:
+                raise ValueError(f"找不到工作表: {', '.join(missing)}")
+            selected = [(name, available[name]) for name in sheet_names]
+        else:
+            selected = parts['sheets']
+
+        for sheet_name, part in selected:
+            analysis = (analyses or {}).get(sheet_name) or analyze_sheet_part(zf, part, shared_strings, sheet_name)
+            max_rows = analysis['actual_rows'] if analysis['non_empty_cells'] else 0
+            max_cols = analysis['actual_cols']
+            rows = iter_sheet_rows(zf, part, shared_strings, max_rows, max_cols, date_styles, epoch)
+
+            output_path = output_dir / f"{excel_path.stem}.{EXPORT_FILENAME_RE.sub('_', sheet_name)}{suffix}"
+            if export_format == 'csv':
+                _export_csv(rows, output_path)
+            else:
+                _export_parquet(rows, output_path, max_cols)
+            logger.info(f"已匯出 {sheet_name}: {max_rows:,} x {max_cols} -> {output_path.name}")
+            exported.append(output_path)
+    return exported
+
+def record_part_bytes(file_path, counter):
+    """剖析時記錄檔案中每個工作表XML的大小（bytes_read 或 bytes_written）"""
+    if PROFILE_COUNTERS is None:
+        return
+    try:
+        with zipfile.ZipFile(file_path) as zf:
+            for sheet_name, part in read_workbook_parts(zf)['sheets']:
+                count_profile(sheet_name, **{counter: zf.getinfo(part).file_size})
+    except (zipfile.BadZipFile, KeyError, OSError):
+        pass
+
+def run_with_profile(profile_dir, file_path, *args, **kwargs):
+    """以cProfile與tracemalloc執行 analyze_excel()，並輸出剖析結果
+
+    產出檔案（<檔名>.<時間戳記> 為前綴）:
+        .pstats            cProfile 結果，可用 python -m pstats 或 snakeviz 檢視
+        .allocations.txt   tracemalloc 記憶體配置前幾名
+        .counters.json     各工作表熱點路徑計數、執行時間與記憶體峰值
+    """
+    global PROFILE_COUNTERS
+
+    profile_dir = Path(profile_dir)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    prefix = profile_dir / f"{Path(file_path).name}.{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    PROFILE_COUNTERS = {}
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = profiler.runcall(analyze_excel, file_path, *args, **kwargs)
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        counters = PROFILE_COUNTERS
+        PROFILE_COUNTERS = None
+
+    profiler.dump_stats(f"{prefix}.pstats")
+
+    top_stats = snapshot.statistics('lineno')
+    with open(f"{prefix}.allocations.txt", 'w', encoding='utf-8') as fp:
+        fp.write(f"記憶體峰值: {peak_memory / 1024 / 1024:.2f} MB\n")
+        fp.write(f"記憶體配置前 {PROFILE_TOP_ALLOCATIONS} 名:\n")
+        for stat in top_stats[:PROFILE_TOP_ALLOCATIONS]:
+            fp.write(f"{stat}\n")
+
+    _write_json_atomic(Path(f"{prefix}.counters.json"), {
+        'file': str(Path(file_path).resolve()),
+        'elapsed_seconds': round(elapsed, 3),
+        'peak_traced_memory_bytes': peak_memory,
+        'result': result,
+        'sheets': counters,
+    })
+    logger.info(f"剖析結果已寫入: {prefix}.*")
+    return result
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    mode TEXT NOT NULL,
+    host TEXT,
+    file_name TEXT,
+    file_hash TEXT,
+    file_size INTEGER,
+    output_size INTEGER,
+    bytes_saved INTEGER,
+    success INTEGER NOT NULL,
+    has_issues INTEGER NOT NULL,
+    issues_count INTEGER NOT NULL,
+    fixed INTEGER NOT NULL,
+    error TEXT,
+    total_seconds REAL,
+    analyze_seconds REAL,
+    fix_seconds REAL,
+    verify_seconds REAL,
+    peak_rss_kb INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS runs_file_hash ON runs (file_hash);
+CREATE TABLE IF NOT EXISTS sheets (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    sheet_name TEXT,
+    reported_rows INTEGER,
+    reported_cols INTEGER,
+    actual_rows INTEGER,
+    actual_cols INTEGER,
+    phantom_rows INTEGER,
+    phantom_cols INTEGER,
+    scanned_cells INTEGER,
+    non_empty_cells INTEGER,
+    has_size_issue INTEGER
+);
+CREATE INDEX IF NOT EXISTS sheets_run_id ON sheets (run_id);
+"""
+
+def start_run_record():
+    """開始收集本次執行的執行紀錄（各階段耗時、各工作表結果與記憶體峰值的起點）"""
+    global RUN_RECORD, RUN_RECORD_COUNT
+    RUN_RECORD_COUNT += 1
+    RUN_RECORD = {'stages': {}, 'sheets': [], 'rss': start_rss_window()}
+
+def file_sha256(path):
+    """分塊計算檔案的SHA-256，記憶體用量固定"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(STREAM_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_content_key(path):
+    """執行紀錄中辨識同一檔案的雜湊
+
+    .xlsx/.xlsm 只讀中央目錄，以各成員的名稱、CRC-32 與大小計算，不必讀完整個檔案
+    （--fail-fast 通常只讀一個工作表）；無法以zip開啟的檔案（.xls）才計算整個檔案的SHA-256。
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            members = sorted(f"{info.filename}:{_member_key(info)}" for info in zf.infolist())
+    except zipfile.BadZipFile:
+        return file_sha256(path)
+    return hashlib.sha256('\n'.join(members).encode('utf-8')).hexdigest()
+
+def _ru_maxrss_kb(who):
+    """getrusage() 的常駐記憶體峰值 (KB)；macOS 的單位是位元組，Linux 是 KB"""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def _read_vm_hwm_kb():
+    """Linux 的 VmHWM：上次重設後本程序的常駐記憶體峰值 (KB)，無法讀取時回傳 None"""
+    try:
+        with open('/proc/self/status', encoding='ascii') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def start_rss_window():
+    """開始量測一次執行的記憶體峰值
+
+    ru_maxrss 是整個程序生命週期的峰值，監看模式的工作程序連續處理多個檔案時會沿用前一個檔案的峰值，
+    因此在 Linux 上先寫入 /proc/self/clear_refs 重設 VmHWM，只量測本次執行。
+    """
+    reset = False
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as fp:
+            fp.write('5')
+        reset = _read_vm_hwm_kb() is not None
+    except OSError:
+        pass
+    return {
+        'reset': reset,
+        'first': RUN_RECORD_COUNT <= 1,
+        'children': _ru_maxrss_kb(resource.RUSAGE_CHILDREN) if resource is not None else 0,
+    }
+
+def peak_rss_kb(window):
+    """start_rss_window() 之後本次執行的常駐記憶體峰值 (KB)
+
+    包含本次執行期間結束的子程序（平行修復的工作程序）。
+    無法重設 VmHWM 的平台只有程序的第一次執行（一般命令列模式）能取得，其餘回傳 None。
+    """
+    if window['reset']:
+        own = _read_vm_hwm_kb()
+    elif window['first'] and resource is not None:
+        own = _ru_maxrss_kb(resource.RUSAGE_SELF)
+    else:
+        return None
+    children = _ru_maxrss_kb(resource.RUSAGE_CHILDREN) if resource is not None else 0
+    if children <= window['children']:
+        children = 0  # 子程序峰值沒有增加，代表來自先前的執行
+    return max(own or 0, children) or None
+
+def open_history(history_path, create=True):
+    """開啟執行紀錄資料庫，需要時建立資料表與索引
+
+    多個監看工作程序會同時寫入，使用WAL模式並在鎖定時等待。
+    """
+    history_path = Path(history_path)
+    if create:
+        history_path.parent.mkdir(parents=True, exist_ok=True)
+    elif not history_path.exists():
+        raise FileNotFoundError(f"執行紀錄 {history_path} 不存在")
+    conn = sqlite3.connect(str(history_path), timeout=30)
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] < HISTORY_SCHEMA_VERSION:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(HISTORY_SCHEMA)
+            conn.execute(f"PRAGMA user_version = {HISTORY_SCHEMA_VERSION}")
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+def append_history(history_path, mode, source_path, result, started_at, total_seconds):
+    """將一次執行的檔案與各工作表結果附加到執行紀錄
+
+    需先呼叫 start_run_record()；寫入失敗只記錄警告，不影響執行結果與退出碼。
+    """
+    global RUN_RECORD
+    record, RUN_RECORD = RUN_RECORD or {'stages': {}, 'sheets': []}, None
+    try:
+        source = Path(source_path)
+        file_size = file_hash = None
+        if source.is_file():
+            file_size = source.stat().st_size
+            file_hash = file_content_key(source)
+        output = Path(result.get('file_path') or source)
+        fixed = bool(result.get('success')) and output.is_file() and output.resolve() != source.resolve()
+        output_size = output.stat().st_size if fixed else None
+        bytes_saved = file_size - output_size if fixed and file_size is not None else None
+        stages = record['stages']
+
+        conn = open_history(history_path)
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO runs (started_at, mode, host, file_name, file_hash, file_size, output_size, "
+                    "bytes_saved, success, has_issues, issues_count, fixed, error, total_seconds, "
+                    "analyze_seconds, fix_seconds, verify_seconds, peak_rss_kb) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (started_at, mode, socket.gethostname(), source.name, file_hash, file_size, output_size,
+                     bytes_saved, int(bool(result.get('success'))), int(bool(result.get('has_issues'))),
+                     result.get('issues_count', 0), int(fixed), result.get('error'), total_seconds,
+                     stages.get('analyze'), stages.get('fix'), stages.get('verify'),
+                     peak_rss_kb(record['rss']) if 'rss' in record else None))
+                conn.executemany(
+                    "INSERT INTO sheets (run_id, sheet_name, reported_rows, reported_cols, actual_rows, actual_cols, "
+                    "phantom_rows, phantom_cols, scanned_cells, non_empty_cells, has_size_issue) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(cursor.lastrowid, sheet_name, a['reported_rows'], a['reported_cols'], a['actual_rows'],
+                      a['actual_cols'], max(a['reported_rows'] - a['actual_rows'], 0),
+                      max(a['reported_cols'] - a['actual_cols'], 0), a['scanned_cells'], a['non_empty_cells'],
+                      int(a['has_size_issue']))
+                     for sheet_name, a in record['sheets']])
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"無法寫入執行紀錄 {history_path}: {e}")
+
+def _open_inotify(directory):
+    """在Linux上以inotify監看目錄，不支援時回傳None改用輪詢"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(str(directory)), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+def _sleep_unless_stopping(seconds, stopping):
+    """分段睡眠，收到停止信號後最多一秒內返回"""
+    deadline = time.time() + seconds
+    while not stopping:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, 1.0))
+
+def _wait_for_inbox(inotify_fd, timeout, stopping, settle_seconds=0.0):
+    """等待收件匣出現新檔案、逾時或收到停止信號
+
+    收到inotify事件時，剛移入的檔案還沒靜置夠久，先等待 settle_seconds 再返回重新掃描。
+    其他主機寫入共享目錄時inotify收不到事件，仍靠逾時後的輪詢發現。
+    """
+    if inotify_fd is None:
+        _sleep_unless_stopping(timeout, stopping)
+        return
+    deadline = time.time() + timeout
+    while not stopping:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        # 分段等待，收到停止信號後最多一秒內結束
+        readable, _, _ = select.select([inotify_fd], [], [], min(remaining, 1.0))
+        if readable:
+            try:
+                while os.read(inotify_fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            _sleep_unless_stopping(settle_seconds, stopping)
+            return
+
+def seconds_until_settled(inbox, settle_seconds):
+    """收件匣中尚未靜置夠久的檔案最快還要多久可以認領，沒有這類檔案時回傳 None"""
+    now = time.time()
+    waits = []
+    for entry in os.scandir(inbox):
+        if entry.name.startswith('.') or not entry.name.lower().endswith(SPOOL_EXTENSIONS):
+            continue
+        try:
+            age = now - entry.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if age < settle_seconds:
+            waits.append(settle_seconds - age)
+    return min(waits) if waits else None
+
+def init_spool(spool_dir):
+    """建立佇列目錄結構，回傳 {'inbox': Path, 'work': Path, 'done': Path, 'failed': Path}"""
+    spool = {name: Path(spool_dir) / name for name in SPOOL_DIRS}
+    for path in spool.values():
+        path.mkdir(parents=True, exist_ok=True)
+    return spool
+
+def _write_json_atomic(path, data):
+    """先寫入暫存檔再rename，讀取方不會看到寫到一半的JSON"""
+    tmp_path = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+    os.replace(tmp_path, path)
+
+def write_lease(job_dir, source_name, lease_ttl, attempts=1):
+    """寫入（或續約）工作租約，記錄來源檔名、持有的主機與程序、已嘗試次數及到期時間"""
+    _write_json_atomic(job_dir / LEASE_SUFFIX, {
+        'source': source_name,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'attempts': attempts,
+        'expires_at': time.time() + lease_ttl,
+    })
+
+def owns_lease(job_dir):
+    """租約是否仍由本程序持有；過期後被其他程序回收時工作目錄已不存在或租約屬於他人"""
+    lease = read_lease(job_dir)
+    return bool(lease) and lease.get('host') == socket.gethostname() and lease.get('pid') == os.getpid()
+
+def renew_lease(job_dir, source_name, lease_ttl, attempts):
+    """續約前確認仍持有租約，回傳 False 表示租約已遺失"""
+    if not owns_lease(job_dir):
+        return False
+    try:
+        write_lease(job_dir, source_name, lease_ttl, attempts)
+    except FileNotFoundError:
+        return False  # 工作目錄剛被其他程序回收
+    return True
+
+def read_lease(job_dir):
+    """讀取工作租約，不存在或損毀時回傳 None"""
+    try:
+        return json.loads((job_dir / LEASE_SUFFIX).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+def claim_next_file(spool, lease_ttl, settle_seconds):
+    """從收件匣認領一個檔案
+
+    先建立工作目錄並寫入租約，再以rename原子性地把檔案移入；
+    rename失敗代表檔案已被其他程序（或其他主機）認領。
+
+    Returns:
+        tuple: (工作目錄, 檔案路徑, 嘗試次數)，收件匣沒有可處理的檔案時回傳 None
+    """
+    now = time.time()
+    candidates = []
+    for entry in os.scandir(spool['inbox']):
+        name = entry.name
+        # 隱藏檔與非Excel副檔名視為上傳中的暫存檔
+        if name.startswith('.') or not name.lower().endswith(SPOOL_EXTENSIONS):
+            continue
+        try:
+            if not entry.is_file():
+                continue
+            mtime = entry.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if now - mtime < settle_seconds:
+            continue
+        candidates.append((mtime, name))
+
+    for _, name in sorted(candidates):
+        job_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{socket.gethostname()}-{os.getpid()}-{os.urandom(3).hex()}"
+        job_dir = spool['work'] / job_id
+        job_dir.mkdir()
+        write_lease(job_dir, name, lease_ttl)
+        try:
+            os.rename(spool['inbox'] / name, job_dir / name)
+        except FileNotFoundError:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            continue
+        # 租約過期被退回的檔案，延續之前的嘗試次數
+        attempts = 1
+        attempts_path = spool['inbox'] / f".{name}{ATTEMPTS_SUFFIX}"
+        try:
+            attempts = int(attempts_path.read_text(encoding='utf-8')) + 1
+            attempts_path.unlink()
+        except (OSError, ValueError):
+            pass
+        if attempts > 1:
+            write_lease(job_dir, name, lease_ttl, attempts)
+        logger.debug(f"已認領 {name} -> {job_dir.name}（第 {attempts} 次）")
+        return job_dir, job_dir / name, attempts
+    return None
+
+def reclaim_expired_leases(spool, lease_ttl):
+    """將租約過期（程序當機或主機離線）的檔案退回收件匣，讓其他程序重新處理"""
+    now = time.time()
+    for entry in os.scandir(spool['work']):
+        if not entry.is_dir():
+            continue
+        job_dir = Path(entry.path)
+        lease = read_lease(job_dir)
+        if lease is None:
+            # 建立目錄後尚未寫入租約就中斷，此時目錄內不會有來源檔
+            try:
+                if job_dir.stat().st_mtime + lease_ttl > now:
+                    continue
+            except FileNotFoundError:
+                continue
+        elif lease.get('expires_at', 0) > now:
+            continue
+
+        source_name = (lease or {}).get('source')
+        attempts = (lease or {}).get('attempts', 1)
+        if source_name and (job_dir / source_name).exists() and attempts >= SPOOL_MAX_ATTEMPTS:
+            # 反覆讓處理程序或主機當機的檔案不再退回收件匣
+            finalize_spool_job(spool, job_dir, source_name, {
+                'success': False,
+                'has_issues': False,
+                'file_path': str(job_dir / source_name),
+                'issues_count': 0,
+                'error': f"已嘗試 {attempts} 次仍未完成（處理程序或主機異常結束）"
+            }, job_dir.stat().st_mtime, check_lease=False)
+            continue
+        if source_name and (job_dir / source_name).exists():
+            returned_name = return_to_inbox(spool, job_dir, source_name, attempts)
+            if returned_name is None:
+                continue  # 來源檔仍在工作目錄中，保留目錄等下次再回收
+            logger.warning(f"{lease.get('host')}:{lease.get('pid')} 的租約過期，已將 {source_name} "
+                           f"以 {returned_name} 退回收件匣")
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+def return_to_inbox(spool, job_dir, source_name, attempts):
+    """將工作目錄中的來源檔移回收件匣，回傳收件匣中的檔名；移動失敗回傳 None
+
+    收件匣已有同名的新上傳檔案時改用 <工作ID>-<檔名>，兩者都保留。
+    以 hard link 建立目標，已存在時會失敗而不是覆蓋，確認連結成功後才刪除原檔。
+    """
+    source = job_dir / source_name
+    for name in (source_name, f"{job_dir.name}-{source_name}"):
+        target = spool['inbox'] / name
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            continue
+        except FileNotFoundError:
+            return None  # 其他程序已搶先回收
+        except OSError as e:
+            logger.warning(f"無法將 {source_name} 退回收件匣: {e}")
+            return None
+        # 嘗試次數在連結成功後才寫入，避免同名的新上傳檔案沿用舊的次數
+        (spool['inbox'] / f".{name}{ATTEMPTS_SUFFIX}").write_text(str(attempts), encoding='utf-8')
+        source.unlink()
+        return name
+    return None
+
+def _init_spool_worker():
+    """工作程序忽略Ctrl+C並恢復SIGTERM預設行為，停止流程由主程序統一處理"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def run_spool_job(file_path, fix_issues, fail_fast, compression='default', history_path=None, index_path=None):
+    """在工作程序中處理一個已認領的檔案"""
+    started = time.time()
+    if history_path:
+        start_run_record()
+    # 監看模式已在檔案層級平行處理，工作表修復在本程序內依序進行以免超額佔用CPU
+    result = analyze_excel(file_path, fix_issues, fail_fast, compression=compression, jobs=1, index_path=index_path)
+    result['elapsed_seconds'] = round(time.time() - started, 3)
+    if history_path:
+        append_history(history_path, 'watch', file_path, result, started, result['elapsed_seconds'])
+    return result
+
+def finalize_spool_job(spool, job_dir, source_name, result, claimed_at, check_lease=True):
+    """將原始檔與產出檔移至 done/ 或 failed/，並寫入同名的 .json 附檔
+
+    <檔名>.json 永遠是最近一次的結果；同名檔案先前的附檔改名為 <工作ID>-<檔名>.json。
+    check_lease 時若租約已被其他程序回收，捨棄本次結果並回傳 False。
+    """
+    if check_lease and not owns_lease(job_dir):
+        logger.warning(f"{source_name} 的租約已被其他程序回收，捨棄本次結果")
+        return False
+    target_dir = spool['done'] if result.get('success') else spool['failed']
+    try:
+        job_files = sorted(job_dir.iterdir())
+    except FileNotFoundError:
+        logger.warning(f"{source_name} 的工作目錄已被其他程序回收，捨棄本次結果")
+        return False
+    moved = {}
+    for path in job_files:
+        if path.name == LEASE_SUFFIX:
+            continue
+        dest = target_dir / path.name
+        if dest.exists():
+            dest = target_dir / f"{job_dir.name}-{path.name}"
+        shutil.move(str(path), str(dest))
+        moved[path.name] = dest
+
+    result_name = Path(result.get('file_path', '')).name
+    if result_name in moved:
+        result['file_path'] = str(moved[result_name].resolve())
+
+    for previous_dir in (spool['done'], spool['failed']):
+        previous = previous_dir / f"{source_name}.json"
+        try:
+            previous_job = json.loads(previous.read_text(encoding='utf-8')).get('job', 'previous')
+            os.replace(previous, previous_dir / f"{previous_job}-{source_name}.json")
+        except (OSError, ValueError):
+            pass
+
+    _write_json_atomic(target_dir / f"{source_name}.json", {
+        'source': source_name,
+        'job': job_dir.name,
+        'host': socket.gethostname(),
+        'claimed_at': datetime.fromtimestamp(claimed_at).isoformat(timespec='seconds'),
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'outputs': sorted(dest.name for dest in moved.values()),
+        'result': result,
+    })
+    shutil.rmtree(job_dir, ignore_errors=True)
+    logger.info(f"{'完成' if result.get('success') else '失敗'}: {source_name} -> {target_dir.name}/")
+    return True
+
+def renew_job_leases(in_flight, retries, lease_ttl):
+    """續約進行中與等待重試的工作，租約已遺失的工作從清單中移除
+
+    等待重試的工作可能排在大檔案之後超過租約時間，不續約會被本程序自己的回收流程退回收件匣。
+
+    Args:
+        in_flight: {future: (工作目錄, 來源檔名, 認領時間, 嘗試次數)}
+        retries: [(工作目錄, 來源檔名, 認領時間, 嘗試次數), ...]
+    """
+    for future, (job_dir, source_name, _, attempts) in list(in_flight.items()):
+        if not renew_lease(job_dir, source_name, lease_ttl, attempts):
+            logger.warning(f"{source_name} 的租約已被其他程序回收，捨棄進行中的結果")
+            del in_flight[future]
+    for job in list(retries):
+        job_dir, source_name, _, attempts = job
+        if not renew_lease(job_dir, source_name, lease_ttl, attempts):
+            logger.warning(f"{source_name} 的租約已被其他程序回收，不再重試")
+            retries.remove(job)
+
+def watch_spool(spool_dir, workers=1, fix_issues=False, fail_fast=True, poll_interval=5.0,
+                lease_ttl=300.0, settle_seconds=1.0, once=False, compression='default', history_path=None,
+                index_path=DEFAULT_STORE):
+    """監看佇列目錄並以固定數量的工作程序持續處理檔案
+
+    同一個佇列可由多個程序（甚至共享檔案系統的多台主機）同時消化：
+    認領靠rename的原子性，當機程序遺留的工作在租約過期後自動退回收件匣。
+    工作程序異常結束時重建程序池，同一檔案最多嘗試 SPOOL_MAX_ATTEMPTS 次後移至 failed/。
+    """
+    spool = init_spool(spool_dir)
+    index_path = resolve_store_path(index_path, SHEET_INDEX_FILENAME, '工作表分析索引')
+    history_path = resolve_store_path(history_path, HISTORY_FILENAME, '執行紀錄')
+    inotify_fd = _open_inotify(spool['inbox'])
+    logger.info(f"監看 {spool['inbox']} ({'inotify' if inotify_fd is not None else '輪詢'}, {workers} 個工作程序)")
+
+    stopping = []
+    def request_stop(signum, frame):
+        logger.warning("收到停止信號，處理完進行中的檔案後結束")
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    in_flight = {}   # future -> (工作目錄, 來源檔名, 認領時間, 嘗試次數)
+    retries = []     # 曾與異常結束的工作程序同時執行的工作，逐一單獨重試以找出元兇
+    last_renewal = time.time()
+
+    def submit(job):
+        job_dir, source_name, _, _ = job
+        try:
+            future = pool.submit(run_spool_job, str(job_dir / source_name), fix_issues, fail_fast, compression,
+                                 history_path, index_path)
+        except BrokenProcessPool:
+            retries.insert(0, job)  # 尚未開始執行，重建程序池後再送出，不計入嘗試次數
+            raise
+        in_flight[future] = job
+
+    def retry_or_fail(job):
+        job_dir, source_name, claimed_at, attempts = job
+        if attempts >= SPOOL_MAX_ATTEMPTS:
+            finalize_spool_job(spool, job_dir, source_name, {
+                'success': False,
+                'has_issues': False,
+                'file_path': str(job_dir / source_name),
+                'issues_count': 0,
+                'error': f"已嘗試 {attempts} 次，工作程序皆異常結束（可能記憶體不足）"
+            }, claimed_at)
+        elif renew_lease(job_dir, source_name, lease_ttl, attempts + 1):
+            retries.append((job_dir, source_name, claimed_at, attempts + 1))
+        else:
+            logger.warning(f"{source_name} 的租約已被其他程序回收，不再重試")
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_spool_worker)
+    try:
+        while True:
+            broken = False
+            if not stopping:
+                reclaim_expired_leases(spool, lease_ttl)
+                try:
+                    if retries:
+                        # 重試的工作單獨執行，若再次讓工作程序異常結束即可確定是它造成的
+                        if not in_flight:
+                            job = retries.pop(0)
+                            if owns_lease(job[0]):
+                                submit(job)
+                            else:
+                                logger.warning(f"{job[1]} 的租約已被其他程序回收，不再重試")
+                    else:
+                        while len(in_flight) < workers:
+                            claimed = claim_next_file(spool, lease_ttl, settle_seconds)
+                            if claimed is None:
+                                break
+                            job_dir, file_path, attempts = claimed
+                            job = (job_dir, file_path.name, time.time(), attempts)
+                            if attempts > 1:
+                                retries.append(job)
+                                break
+                            submit(job)
+                except BrokenProcessPool:
+                    broken = True
+
+            if not in_flight and not broken:
+                if stopping or (once and not retries):
+                    break
+                if retries:
+                    continue
+                settle_wait = seconds_until_settled(spool['inbox'], settle_seconds)
+                timeout = poll_interval if settle_wait is None else min(poll_interval, settle_wait)
+                _wait_for_inbox(inotify_fd, timeout, stopping, settle_seconds)
+                continue
+
+            if not broken:
+                finished, _ = wait(list(in_flight), timeout=min(poll_interval, lease_ttl / 3),
+                                   return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = in_flight.pop(future)
+                    job_dir, source_name, claimed_at, _ = job
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        retry_or_fail(job)
+                        continue
+                    except Exception as e:
+                        result = {
+                            'success': False,
+                            'has_issues': False,
+                            'file_path': str(job_dir / source_name),
+                            'issues_count': 0,
+                            'error': str(e)
+                        }
+                    finalize_spool_job(spool, job_dir, source_name, result, claimed_at)
+
+            if broken:
+                # 工作程序被終止（例如OOM）時整個程序池失效，其餘進行中的工作也一併重試
+                logger.error("工作程序異常結束，重建工作程序池")
+                for job in list(in_flight.values()):
+                    retry_or_fail(job)
+                in_flight.clear()
+                pool.shutdown(wait=True)
+                pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_spool_worker)
+                continue
+
+            # 定期續約，避免處理大檔案時被其他程序誤判為當機
+            if time.time() - last_renewal >= lease_ttl / 3:
+                renew_job_leases(in_flight, retries, lease_ttl)
+                last_renewal = time.time()
+    finally:
+        pool.shutdown(wait=True)
+        if inotify_fd is not None:
+            os.close(inotify_fd)
+
+def watch_main(argv):
+    """watch 子命令的參數解析"""
+    parser = argparse.ArgumentParser(
+        prog='excel_analyzer_cli.py watch',
+        description='監看模式 - 持續處理佇列目錄中的Excel檔案',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+佇列目錄結構:
+  inbox/   放入待處理檔案（請先寫入暫存名稱或隱藏檔，完成後再rename進來）
+  work/    處理中的工作目錄與租約檔
+  done/    處理成功的檔案、修復結果與 <檔名>.json 附檔
+  failed/  分析失敗的檔案與 <檔名>.json 附檔
+
+使用範例:
+  uv run excel_analyzer_cli.py watch /var/spool/excel --workers 4 --fix
+  uv run excel_analyzer_cli.py watch /var/spool/excel --once   # 處理完現有檔案即結束
+        """
+    )
+    parser.add_argument('spool_dir', help='佇列根目錄')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='工作程序數量（預設為CPU核心數）')
+    parser.add_argument('--fix', action='store_true', help='自動修復發現的問題')
+    parser.add_argument('--no-fail-fast', dest='fail_fast', action='store_false',
+                        help='檢測時分析所有工作表')
+    parser.add_argument('--compression', choices=list(COMPRESSION_LEVELS), default='default',
+                        help='修復檔案的壓縮等級（預設 default）')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='輪詢間隔秒數（預設5秒）')
+    parser.add_argument('--lease-ttl', type=float, default=300.0, help='租約有效秒數，逾時未續約的工作會被退回收件匣（預設300秒）')
+    parser.add_argument('--settle', type=float, default=1.0, help='檔案最後修改後需靜置的秒數才會被認領（預設1秒）')
+    parser.add_argument('--once', action='store_true', help='處理完收件匣現有檔案後結束')
+    parser.add_argument('--history', metavar='PATH', default=DEFAULT_STORE,
+                        help=f'執行紀錄SQLite檔（預設 ${CACHE_DIR_ENV} 或 ~/.cache/excel_analyzer/history.sqlite3）')
+    parser.add_argument('--no-history', dest='history', action='store_const', const=None, help='不寫入執行紀錄')
+    parser.add_argument('--debug', action='store_true', help='啟用詳細除錯訊息')
+
+    args = parser.parse_args(argv)
+
+    if not args.debug:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+
+    watch_spool(args.spool_dir, max(args.workers, 1), args.fix, args.fail_fast,
+                args.poll_interval, args.lease_ttl, args.settle, args.once, args.compression, args.history)
+
+def parse_since(text):
+    """將 '7d'、'24h'、'30m' 或 ISO 日期 (2025-09-01) 轉為起始時間戳"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([dhm])', text.strip())
+    if match:
+        seconds = float(match.group(1)) * {'d': 86400, 'h': 3600, 'm': 60}[match.group(2)]
+        return time.time() - seconds
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"無法解析時間範圍: {text}（例如 7d、24h、2025-09-01）")
+
+def _quantile(sorted_values, q):
+    """已排序數列的分位數，於相鄰兩值間線性內插（與 numpy.quantile 預設方法相同）"""
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return float(sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower))
+
+def history_stats(history_path, since=None):
+    """彙整執行紀錄中某個時間點之後的執行結果
+
+    Returns:
+        dict: {
+            'runs': {(模式, 'success'/'failed'): 次數},
+            'window_seconds': float,            # 第一筆到最後一筆紀錄的時間跨度
+            'files': int,                       # 不同檔案（依雜湊）數量
+            'files_with_phantom': int,          # 至少一個工作表有幽靈範圍的不同檔案數量（依雜湊）
+            'phantom_sheets': int, 'phantom_rows': int,
+            'fixed': int, 'bytes_processed': int, 'bytes_saved': int,
+            'latency': {分位數: 秒}, 'latency_sum': float, 'latency_count': int,
+            'stage_seconds': {階段: 秒},
+            'phantom_fix_seconds': float,       # 修復有幽靈範圍檔案所花的時間
+            'files_per_hour': float or None,
+            'peak_rss_kb': int or None          # 各次執行期間記憶體峰值的最大值
+        }
+    """
+    conn = open_history(history_path, create=False)
+    try:
+        runs = conn.execute(
+            "SELECT mode, success, started_at, total_seconds, file_hash, file_size, bytes_saved, fixed, "
+            "analyze_seconds, fix_seconds, verify_seconds, peak_rss_kb FROM runs WHERE started_at >= ?",
+            (since or 0,)).fetchall()
+        files_with_phantom, phantom_sheets, phantom_rows, phantom_fix_seconds = conn.execute(
+            "SELECT COUNT(DISTINCT COALESCE(r.file_hash, r.id)), COUNT(*), COALESCE(SUM(s.phantom_rows), 0), "
+            "(SELECT COALESCE(SUM(fix_seconds), 0) FROM runs WHERE started_at >= ? AND id IN "
+            " (SELECT run_id FROM sheets WHERE has_size_issue = 1)) "
+            "FROM sheets s JOIN runs r ON r.id = s.run_id WHERE r.started_at >= ? AND s.has_size_issue = 1",
+            (since or 0, since or 0)).fetchone()
+    finally:
+        conn.close()
+
+    counts = {}
+    for mode, success, *_ in runs:
+        key = (mode, 'success' if success else 'failed')
+        counts[key] = counts.get(key, 0) + 1
+    latencies = sorted(run[3] for run in runs if run[3] is not None)
+    started = [run[2] for run in runs]
+    window_seconds = max(started) - min(started) if started else 0.0
+    peaks = [run[11] for run in runs if run[11] is not None]
+
+    return {
+        'runs': counts,
+        'window_seconds': window_seconds,
+        'files': len({run[4] for run in runs if run[4]}),
+        'files_with_phantom': files_with_phantom,
+        'phantom_sheets': phantom_sheets,
+        'phantom_rows': phantom_rows,
+        'fixed': sum(run[7] for run in runs),
+        'bytes_processed': sum(run[5] or 0 for run in runs),
+        'bytes_saved': sum(run[6] or 0 for run in runs),
+        'latency': {q: _quantile(latencies, q) for q in HISTORY_QUANTILES} if latencies else {},
+        'latency_sum': float(sum(latencies)),
+        'latency_count': len(latencies),
+        'stage_seconds': {stage: sum(run[8 + i] or 0.0 for run in runs) for i, stage in enumerate(HISTORY_STAGES)},
+        'phantom_fix_seconds': phantom_fix_seconds,
+        'files_per_hour': len(runs) / (window_seconds / 3600) if window_seconds > 0 else None,
+        'peak_rss_kb': max(peaks) if peaks else None,
+    }
+
+def format_prometheus(stats):
+    """將 history_stats() 的結果轉為 Prometheus textfile collector 格式"""
+    lines = []
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f"# HELP excel_analyzer_{name} {help_text}")
+        lines.append(f"# TYPE excel_analyzer_{name} {metric_type}")
+        for labels, value in samples:
+            label_text = '{' + ','.join(f'{key}="{val}"' for key, val in labels) + '}' if labels else ''
+            lines.append(f"excel_analyzer_{name}{label_text} {value}")
+
+    metric('runs', 'gauge', '時間範圍內依模式與結果分類的執行次數',
+           [((('mode', mode), ('outcome', outcome)), count) for (mode, outcome), count in sorted(stats['runs'].items())])
+    metric('files', 'gauge', '不同檔案數量（依內容雜湊）', [((), stats['files'])])
+    metric('files_with_phantom', 'gauge', '至少有一個工作表有幽靈範圍的不同檔案數量（依內容雜湊）',
+           [((), stats['files_with_phantom'])])
+    metric('phantom_sheets', 'gauge', '有幽靈範圍的工作表數量', [((), stats['phantom_sheets'])])
+    metric('phantom_rows', 'gauge', '超出真實資料範圍的幽靈行數', [((), stats['phantom_rows'])])
+    metric('fixed_files', 'gauge', '寫出修復檔案的執行次數', [((), stats['fixed'])])
+    metric('bytes_processed', 'gauge', '分析的輸入位元組數', [((), stats['bytes_processed'])])
+    metric('bytes_saved', 'gauge', '修復檔案相較輸入檔案節省的位元組數', [((), stats['bytes_saved'])])
+    metric('run_duration_seconds', 'summary', '每次執行的耗時',
+           [((('quantile', q),), round(value, 6)) for q, value in stats['latency'].items()])
+    lines.append(f"excel_analyzer_run_duration_seconds_sum {round(stats['latency_sum'], 6)}")
+    lines.append(f"excel_analyzer_run_duration_seconds_count {stats['latency_count']}")
+    metric('stage_seconds', 'gauge', '各階段累計耗時',
+           [((('stage', stage),), round(seconds, 6)) for stage, seconds in stats['stage_seconds'].items()])
+    metric('phantom_fix_seconds', 'gauge', '修復有幽靈範圍檔案的累計耗時',
+           [((), round(stats['phantom_fix_seconds'], 6))])
+    if stats['files_per_hour'] is not None:
+        metric('throughput_files_per_hour', 'gauge', '時間範圍內每小時的執行次數',
+               [((), round(stats['files_per_hour'], 3))])
+    if stats['peak_rss_kb'] is not None:
+        metric('peak_rss_bytes', 'gauge', '各次執行期間常駐記憶體峰值的最大值',
+               [((), stats['peak_rss_kb'] * 1024)])
+    return '\n'.join(lines) + '\n'
+
+def stats_main(argv):
+    """stats 子命令：彙整執行紀錄並可輸出 Prometheus textfile"""
+    parser = argparse.ArgumentParser(
+        prog='excel_analyzer_cli.py stats',
+        description='彙整執行紀錄：吞吐量、延遲分位數、幽靈範圍與節省的空間',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用範例:
+  uv run excel_analyzer_cli.py stats --since 7d
+  uv run excel_analyzer_cli.py stats --prometheus /var/lib/node_exporter/textfile/excel_analyzer.prom
+        """
+    )
+    parser.add_argument('--history', metavar='PATH', default=DEFAULT_STORE,
+                        help=f'執行紀錄SQLite檔（預設 ${CACHE_DIR_ENV} 或 ~/.cache/excel_analyzer/history.sqlite3）')
+    parser.add_argument('--since', type=parse_since, metavar='RANGE', help='只彙整這段時間內的紀錄，例如 7d、24h、2025-09-01')
+    parser.add_argument('--prometheus', metavar='FILE', help='將指標寫入 Prometheus textfile collector 檔案')
+
+    args = parser.parse_args(argv)
+    history_path = resolve_store_path(args.history, HISTORY_FILENAME, '執行紀錄')
+    if history_path is None:
+        print(f"錯誤: 找不到家目錄，請以 --history 或 {CACHE_DIR_ENV} 指定執行紀錄位置", file=sys.stderr)
+        sys.exit(2)
+
+    try:
+        stats = history_stats(history_path, args.since)
+    except (sqlite3.Error, OSError) as e:
+        print(f"錯誤: 無法讀取執行紀錄: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    total_runs = sum(stats['runs'].values())
+    failed = sum(count for (_, outcome), count in stats['runs'].items() if outcome == 'failed')
+    print(f"執行次數: {total_runs:,}（失敗 {failed:,}，不同檔案 {stats['files']:,}）")
+    for (mode, outcome), count in sorted(stats['runs'].items()):
+        print(f"  {mode:<6} {outcome:<8} {count:,}")
+    if stats['files_per_hour'] is not None:
+        print(f"吞吐量: 每小時 {stats['files_per_hour']:,.1f} 個檔案")
+    if stats['latency']:
+        quantiles = '  '.join(f"p{int(q * 100)} {seconds:.2f}s" for q, seconds in stats['latency'].items())
+        print(f"每次執行耗時: {quantiles}")
+    print("各階段累計耗時: " + '  '.join(f"{stage} {seconds:.1f}s" for stage, seconds in stats['stage_seconds'].items()))
+    print(f"有幽靈範圍的檔案: {stats['files_with_phantom']:,}（{stats['phantom_sheets']:,} 個工作表，"
+          f"多出 {stats['phantom_rows']:,} 行），修復耗時 {stats['phantom_fix_seconds']:.1f}s")
+    print(f"已修復: {stats['fixed']:,} 個檔案，節省 {stats['bytes_saved'] / 1024 / 1024:,.2f} MB"
+          f"（共處理 {stats['bytes_processed'] / 1024 / 1024:,.2f} MB）")
+    if stats['peak_rss_kb'] is not None:
+        print(f"記憶體峰值: {stats['peak_rss_kb'] / 1024:,.1f} MB")
+
+    if args.prometheus:
+        # 先寫入暫存檔再rename，node_exporter 不會讀到寫到一半的檔案
+        prom_path = Path(args.prometheus)
+        tmp_path = prom_path.with_name(f".{prom_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(format_prometheus(stats), encoding='utf-8')
+        os.replace(tmp_path, prom_path)
+
 def main():
     parser = argparse.ArgumentParser(
         description='Excel檔案分析器 - 檢測並修復工作表尺寸問題',
@@ -582,6 +3078,13 @@ def main():
   uv run excel_analyzer_cli.py file.xlsx              # 分析檔案
   uv run excel_analyzer_cli.py file.xlsx --fix       # 分析並修復問題
   uv run excel_analyzer_cli.py file.xlsx --check     # 僅檢測模式（適合PHP整合）
+  uv run excel_analyzer_cli.py file.xlsx --check --no-fail-fast  # 檢測所有工作表
+  uv run excel_analyzer_cli.py watch /var/spool/excel --fix  # 監看佇列目錄持續處理
+  uv run excel_analyzer_cli.py stats --since 7d              # 彙整執行紀錄
+  uv run excel_analyzer_cli.py file.xlsx --fix --verify     # 修復並驗證沒有遺失任何資料
+  uv run excel_analyzer_cli.py file.xlsx --fix --profile prof/  # 輸出效能剖析資料
+  uv run excel_analyzer_cli.py file.xlsx --fix --export csv --export-sheets product  # 修復並匯出資料
+  uv run excel_analyzer_cli.py file.xlsx --fix --prune --strip-pivot-cache  # 一併清理未使用的zip成員
   
 退出碼（適合程式整合）:
   0: 檔案正常，無問題
@@ -598,12 +3101,43 @@ def main():
     parser.add_argument('excel_file', help='Excel檔案路徑')
     parser.add_argument('--fix', action='store_true', help='自動修復發現的問題')
     parser.add_argument('--check', action='store_true', help='僅檢測模式，適合程式整合（透過退出碼回報結果）')
+    parser.add_argument('--fail-fast', dest='fail_fast', action='store_true', default=None,
+                        help='發現第一個問題工作表即停止（檢測模式預設啟用）')
+    parser.add_argument('--no-fail-fast', dest='fail_fast', action='store_false',
+                        help='檢測模式下仍分析所有工作表')
+    parser.add_argument('--verify', action='store_true', help='修復後以串流雜湊驗證所有實際儲存格都被保留')
+    parser.add_argument('--compression', choices=list(COMPRESSION_LEVELS), default='default',
+                        help='修復檔案的壓縮等級：fast 較快、max 檔案較小（預設 default）')
+    parser.add_argument('--jobs', type=int, help='平行修復多個工作表的工作程序數量（預設為CPU核心數）')
+    parser.add_argument('--index', metavar='PATH', default=DEFAULT_STORE,
+                        help=f'工作表分析索引檔，內容未變動的工作表不重新掃描（預設 ${CACHE_DIR_ENV} 或 ~/.cache/excel_analyzer/sheet_index.json）')
+    parser.add_argument('--no-index', dest='index', action='store_const', const=None,
+                        help='不讀寫工作表分析索引，每次都重新掃描所有工作表')
+    parser.add_argument('--prune', action='store_true', help='修復時移除沒有任何關聯參照的zip成員（例如未使用的圖片）')
+    parser.add_argument('--strip-pivot-cache', action='store_true',
+                        help='一併移除樞紐分析快取記錄，Excel開啟時會重新整理（隱含 --prune）')
+    parser.add_argument('--strip-calc-chain', action='store_true', help='一併移除 calcChain.xml（隱含 --prune）')
+    parser.add_argument('--export', choices=['csv', 'parquet'], help='將各工作表的真實資料範圍匯出為 CSV 或 Parquet')
+    parser.add_argument('--export-sheets', metavar='NAMES', help='只匯出指定的工作表（以逗號分隔）')
+    parser.add_argument('--export-dir', metavar='DIR', help='匯出目錄（預設與來源檔案相同）')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='將cProfile、tracemalloc與各工作表計數寫入指定目錄（剖析時不使用工作表索引，並忽略 --jobs）')
+    parser.add_argument('--history', metavar='PATH', default=DEFAULT_STORE,
+                        help=f'執行紀錄SQLite檔，可用 stats 子命令彙整（預設 ${CACHE_DIR_ENV} 或 ~/.cache/excel_analyzer/history.sqlite3）')
+    parser.add_argument('--no-history', dest='history', action='store_const', const=None, help='不寫入執行紀錄')
     parser.add_argument('--debug', action='store_true', help='啟用詳細除錯訊息')
     parser.add_argument('--version', action='version', version='Excel Analyzer v1.1')
     
     if len(sys.argv) == 1:
         parser.print_help()
         return
+
+    if sys.argv[1] == 'watch':
+        watch_main(sys.argv[2:])
+        return
+    if sys.argv[1] == 'stats':
+        stats_main(sys.argv[2:])
+        return
     
     args = parser.parse_args()
     
@@ -618,11 +3152,40 @@ def main():
     
     # 檢測模式下不進行修復
     fix_issues = args.fix and not args.check
-    result = analyze_excel(args.excel_file, fix_issues)
+    fail_fast = args.check if args.fail_fast is None else args.fail_fast
+    args.history = resolve_store_path(args.history, HISTORY_FILENAME, '執行紀錄')
+    started = time.time()
+    if args.history:
+        start_run_record()
+    # 匯出時沿用分析階段取得的各工作表真實範圍，不重新掃描
+    sheet_analyses = {}
+    if args.profile:
+        # 剖析時不沿用工作表索引，確保每個工作表都實際掃描並計入讀取位元組；
+        # cProfile與tracemalloc看不到子程序，工作表改在本程序內依序重寫
+        result = run_with_profile(args.profile, args.excel_file, fix_issues, fail_fast, args.verify,
+                                  args.compression, 1, None, args.prune, args.strip_pivot_cache,
+                                  args.strip_calc_chain, sheet_analyses=sheet_analyses)
+    else:
+        result = analyze_excel(args.excel_file, fix_issues, fail_fast, args.verify, args.compression, args.jobs,
+                               args.index, args.prune, args.strip_pivot_cache, args.strip_calc_chain,
+                               sheet_analyses=sheet_analyses)
+    if args.history:
+        append_history(args.history, 'cli', args.excel_file, result, started, round(time.time() - started, 3))
     
     # 在標準終端輸出最終路徑
     print(result['file_path'])
     
+    # 匯出時直接從來源檔案串流讀取，匯出的檔案路徑接續輸出於後
+    if args.export and result['success']:
+        sheet_names = [name.strip() for name in args.export_sheets.split(',')] if args.export_sheets else None
+        try:
+            for exported_path in export_workbook(args.excel_file, args.export, args.export_dir, sheet_names,
+                                                 sheet_analyses):
+                print(exported_path.resolve())
+        except Exception as e:
+            logger.error(f"匯出過程中發生錯誤: {e}")
+            sys.exit(2)
+    
     # 設定適合PHP整合的退出碼
     # 0: 檔案正常，無問題
     # 1: 檔案有問題但已修復（或僅檢測模式下發現問題）
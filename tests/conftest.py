@@ -0,0 +1,58 @@
+"""
+測試共用設定：讓測試可直接匯入 excel_analyzer_cli，並提供產生小型活頁簿的工具
+"""
+
+import sys
+import zipfile
+from pathlib import Path
+
+import openpyxl
+import pytest
+from openpyxl.styles import Font
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import excel_analyzer_cli as cli  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def quiet_logger():
+    cli.logger.remove()
+    yield
+
+
+@pytest.fixture
+def make_workbook(tmp_path):
+    """建立小型活頁簿：sheets 為 {工作表名稱: [[列值, ...], ...]}，phantom_row 指定遠處只有格式的儲存格"""
+    def make(name='book.xlsx', sheets=None, phantom_row=None):
+        wb = openpyxl.Workbook()
+        wb.remove(wb.active)
+        for sheet_name, rows in (sheets or {'Sheet': [['名稱', '數量'], ['a', 1]]}).items():
+            ws = wb.create_sheet(sheet_name)
+            for values in rows:
+                ws.append(values)
+            if phantom_row:
+                ws.cell(phantom_row, 1).font = Font(bold=True)
+        path = tmp_path / name
+        wb.save(path)
+        return path
+    return make
+
+
+@pytest.fixture
+def rewrite_package():
+    """改寫活頁簿的zip成員：edits 為 {成員: 新內容或 舊內容 -> 新內容}，不存在的成員會新增，remove 為要刪除的成員"""
+    def rewrite(path, edits=None, remove=()):
+        edits = dict(edits or {})
+        with zipfile.ZipFile(path) as zf:
+            members = [(info.filename, zf.read(info)) for info in zf.infolist()]
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, data in members:
+                if name in remove:
+                    continue
+                edit = edits.pop(name, None)
+                zf.writestr(name, edit(data) if callable(edit) else data if edit is None else edit)
+            for name, data in edits.items():
+                zf.writestr(name, data)
+        return path
+    return rewrite
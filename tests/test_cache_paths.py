@@ -0,0 +1,61 @@
+"""
+索引與執行紀錄的預設位置：執行時才解析，找不到家目錄時停用而不中止
+"""
+
+import sys
+
+import pytest
+
+import excel_analyzer_cli as cli
+
+
+@pytest.fixture
+def no_home(monkeypatch):
+    """模擬沒有HOME且UID不在passwd中（PHP-FPM、任意UID的容器）"""
+    def no_home_dir():
+        raise RuntimeError("Could not determine home directory.")
+    monkeypatch.delenv('HOME', raising=False)
+    monkeypatch.delenv('XDG_CACHE_HOME', raising=False)
+    monkeypatch.delenv(cli.CACHE_DIR_ENV, raising=False)
+    monkeypatch.setattr(cli.Path, 'home', staticmethod(no_home_dir))
+
+
+def test_cache_dir_precedence(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    assert cli.default_cache_dir() == tmp_path / 'xdg' / 'excel_analyzer'
+    monkeypatch.setenv(cli.CACHE_DIR_ENV, str(tmp_path / 'custom'))
+    assert cli.default_cache_dir() == tmp_path / 'custom'
+
+
+def test_explicit_paths_are_kept(no_home):
+    assert cli.resolve_store_path('/srv/idx.json', cli.SHEET_INDEX_FILENAME, '索引') == '/srv/idx.json'
+    assert cli.resolve_store_path(None, cli.SHEET_INDEX_FILENAME, '索引') is None
+
+
+def test_missing_home_disables_stores(no_home):
+    assert cli.default_cache_dir() is None
+    assert cli.resolve_store_path(cli.DEFAULT_STORE, cli.HISTORY_FILENAME, '執行紀錄') is None
+
+
+@pytest.mark.parametrize("extra_args, expected_code", [(['--check'], 1), ([], 1)])
+def test_cli_runs_without_home(no_home, make_workbook, monkeypatch, capsys, extra_args, expected_code):
+    path = make_workbook(phantom_row=5000)
+    monkeypatch.setattr(sys, 'argv', ['excel_analyzer_cli.py', str(path), *extra_args])
+
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main()
+
+    assert exit_info.value.code == expected_code
+    assert capsys.readouterr().out.strip() == str(path.resolve())
+
+
+def test_cli_uses_cache_dir_env(tmp_path, make_workbook, monkeypatch):
+    monkeypatch.setenv(cli.CACHE_DIR_ENV, str(tmp_path / 'cache'))
+    monkeypatch.setattr(sys, 'argv', ['excel_analyzer_cli.py', str(make_workbook()), '--check'])
+
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main()
+
+    assert exit_info.value.code == 0
+    assert (tmp_path / 'cache' / cli.SHEET_INDEX_FILENAME).exists()
+    assert (tmp_path / 'cache' / cli.HISTORY_FILENAME).exists()
@@ -0,0 +1,93 @@
+"""
+串流匯出：只輸出各工作表的真實資料範圍，日期輸出為日期時間
+"""
+
+import csv
+from datetime import datetime
+
+import openpyxl
+import pytest
+from openpyxl.styles import Font
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+
+import excel_analyzer_cli as cli
+
+PHANTOM_ROW = 5000
+
+
+def _make_dated_workbook(path, epoch=None):
+    """資料之間有空白行、遠處有只有格式的儲存格，另有第二個工作表"""
+    wb = openpyxl.Workbook()
+    if epoch:
+        wb.epoch = epoch
+    ws = wb.active
+    ws.title = "訂單"
+    ws.append(["品項", "數量", "日期"])
+    ws.append(["a", 1, datetime(2024, 1, 2, 8, 30)])
+    ws.append([])
+    ws.append(["b", 2.5, datetime(2024, 3, 4)])
+    for row_idx in (2, 4):
+        ws.cell(row_idx, 3).number_format = 'yyyy-mm-dd hh:mm'
+    ws.cell(PHANTOM_ROW, 1).font = Font(bold=True)
+    ws.cell(1, 60).font = Font(bold=True)
+    wb.create_sheet("摘要").append(["總計", 3.5])
+    wb.save(path)
+    return path
+
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8') as fp:
+        return list(csv.reader(fp))
+
+
+def test_csv_contains_only_the_real_range(tmp_path):
+    source = _make_dated_workbook(tmp_path / "orders.xlsx")
+
+    exported = cli.export_workbook(source, 'csv', tmp_path / "out")
+
+    assert [path.name for path in exported] == ["orders.訂單.csv", "orders.摘要.csv"]
+    assert _read_csv(exported[0]) == [
+        ["品項", "數量", "日期"],
+        ["a", "1", "2024-01-02 08:30:00"],
+        ["", "", ""],
+        ["b", "2.5", "2024-03-04 00:00:00"],
+    ]
+    assert _read_csv(exported[1]) == [["總計", "3.5"]]
+
+
+def test_dates_use_the_1904_system(tmp_path):
+    source = _make_dated_workbook(tmp_path / "mac.xlsx", epoch=CALENDAR_MAC_1904)
+
+    exported = cli.export_workbook(source, 'csv', sheet_names=["訂單"])
+
+    assert exported == [tmp_path / "mac.訂單.csv"]
+    assert [row[2] for row in _read_csv(exported[0])[1:]] == ["2024-01-02 08:30:00", "", "2024-03-04 00:00:00"]
+
+
+def test_unknown_sheet_is_rejected(tmp_path):
+    source = _make_dated_workbook(tmp_path / "orders.xlsx")
+
+    with pytest.raises(ValueError, match="不存在的表"):
+        cli.export_workbook(source, 'csv', sheet_names=["不存在的表"])
+
+
+def test_existing_analyses_are_reused(tmp_path, monkeypatch):
+    source = _make_dated_workbook(tmp_path / "orders.xlsx")
+    analyses = {}
+    cli.analyze_excel(source, index_path=None, sheet_analyses=analyses)
+    monkeypatch.setattr(cli, 'analyze_sheet_part', lambda *args: pytest.fail("不應重新分析工作表"))
+
+    exported = cli.export_workbook(source, 'csv', tmp_path / "out", analyses=analyses)
+
+    assert len(_read_csv(exported[0])) == 4
+
+
+def test_parquet_rows_and_columns(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    source = _make_dated_workbook(tmp_path / "orders.xlsx")
+
+    exported = cli.export_workbook(source, 'parquet', tmp_path / "out", sheet_names=["訂單"])
+
+    table = pq.read_table(exported[0])
+    assert table.column_names == ["A", "B", "C"]
+    assert table.column("C").to_pylist() == ["日期", "2024-01-02 08:30:00", None, "2024-03-04 00:00:00"]
@@ -0,0 +1,138 @@
+"""
+修復流程的往返測試：修復後的檔案能以openpyxl開啟、驗證一致，
+且合併儲存格、日期與共用公式都被保留
+"""
+
+import re
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+import openpyxl
+import pytest
+from openpyxl.styles import Font
+
+import excel_analyzer_cli as cli
+
+DATA_ROWS = 20
+PHANTOM_ROW = 5000
+MACRO_CONTENT_TYPE = b'application/vnd.ms-excel.sheet.macroEnabled.main+xml'
+
+
+def _use_shared_formulas(path, sheet_part):
+    """把D欄逐格的公式改寫為共用公式（openpyxl寫檔時不會產生共用公式）"""
+    with zipfile.ZipFile(path) as zf:
+        members = [(info, zf.read(info)) for info in zf.infolist()]
+
+    def shared(match):
+        row_idx = int(match.group(1))
+        if row_idx == 2:
+            return f'<c r="D2"><f t="shared" ref="D2:D{DATA_ROWS + 1}" si="0">B2*2</f><v></v></c>'
+        return f'<c r="D{row_idx}"><f t="shared" si="0"/><v></v></c>'
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for info, data in members:
+            if info.filename == sheet_part:
+                data = re.sub(rb'<c r="D(\d+)"><f>B\d+\*2</f><v\s*/?>(?:</v>)?</c>',
+                              lambda m: shared(m).encode(), data)
+            zf.writestr(info, data)
+
+
+def _make_bloated_workbook(path, sheet_count=2):
+    """建立含日期、合併儲存格、共用公式，且遠處有格式撐大範圍的活頁簿"""
+    wb = openpyxl.Workbook()
+    for sheet_idx in range(sheet_count):
+        ws = wb.active if sheet_idx == 0 else wb.create_sheet()
+        ws.title = f"資料{sheet_idx + 1}"
+        ws.append(["名稱", "數量", "日期", "兩倍"])
+        for row_idx in range(2, DATA_ROWS + 2):
+            ws.cell(row_idx, 1, f"品項{row_idx}")
+            ws.cell(row_idx, 2, row_idx * 10)
+            ws.cell(row_idx, 3, datetime(2024, 1, row_idx, 8, 30)).number_format = 'yyyy-mm-dd hh:mm'
+            ws.cell(row_idx, 4, f"=B{row_idx}*2")
+        ws.cell(DATA_ROWS + 2, 1, "小計")
+        ws.merge_cells(f"A{DATA_ROWS + 2}:C{DATA_ROWS + 2}")
+        # 只有格式、沒有值的遠處儲存格
+        ws.cell(PHANTOM_ROW, 1).font = Font(bold=True)
+        ws.cell(PHANTOM_ROW, 80).font = Font(italic=True)
+    wb.save(path)
+    _use_shared_formulas(path, 'xl/worksheets/sheet1.xml')
+    return path
+
+
+@pytest.fixture
+def bloated(tmp_path):
+    return _make_bloated_workbook(tmp_path / "bloated.xlsx")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_fixed_file_opens_and_verifies(bloated, jobs):
+    result = cli.analyze_excel(bloated, fix_issues=True, verify=True, jobs=jobs, index_path=None)
+
+    assert result['success'], result['error']
+    assert result['issues_count'] == 2
+    fixed_path = Path(result['file_path'])
+    assert fixed_path.name == "bloated.fixed.xlsx"
+
+    wb = openpyxl.load_workbook(fixed_path)
+    for ws in wb.worksheets:
+        assert ws.max_row < PHANTOM_ROW
+        assert ws.max_column < 80
+    assert all(item['match'] for item in cli.verify_workbook_content(bloated, fixed_path))
+
+
+def test_merged_cells_dates_and_shared_formulas_survive(bloated):
+    result = cli.analyze_excel(bloated, fix_issues=True, index_path=None)
+    assert result['success'], result['error']
+
+    source = openpyxl.load_workbook(bloated)
+    fixed = openpyxl.load_workbook(result['file_path'])
+    for sheet_name in source.sheetnames:
+        source_ws, fixed_ws = source[sheet_name], fixed[sheet_name]
+        assert [str(r) for r in fixed_ws.merged_cells.ranges] == [f"A{DATA_ROWS + 2}:C{DATA_ROWS + 2}"]
+        for row_idx in range(2, DATA_ROWS + 2):
+            date_cell = fixed_ws.cell(row_idx, 3)
+            assert date_cell.value == datetime(2024, 1, row_idx, 8, 30)
+            assert date_cell.is_date
+            assert fixed_ws.cell(row_idx, 4).value == source_ws.cell(row_idx, 4).value == f"=B{row_idx}*2"
+
+
+def test_shared_formula_fixture_is_really_shared(bloated):
+    with zipfile.ZipFile(bloated) as zf:
+        sheet_xml = zf.read('xl/worksheets/sheet1.xml')
+    assert sheet_xml.count(b't="shared"') == DATA_ROWS
+
+
+def test_zip64_output_opens(bloated, monkeypatch):
+    # 以很小的限制強制寫出ZIP64欄位與結尾記錄
+    monkeypatch.setattr(cli, 'ZIP32_LIMIT', 1000)
+    monkeypatch.setattr(cli, 'ZIP32_MAX_ENTRIES', 3)
+    result = cli.analyze_excel(bloated, fix_issues=True, verify=True, index_path=None)
+
+    assert result['success'], result['error']
+    with zipfile.ZipFile(result['file_path']) as zf:
+        assert zf.testzip() is None
+    assert openpyxl.load_workbook(result['file_path']).sheetnames == ["資料1", "資料2"]
+
+
+def test_macro_enabled_workbook_keeps_xlsm_suffix(tmp_path):
+    path = _make_bloated_workbook(tmp_path / "macro.xlsm", sheet_count=1)
+    with zipfile.ZipFile(path) as zf:
+        members = [(info, zf.read(info)) for info in zf.infolist()]
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for info, data in members:
+            if info.filename == '[Content_Types].xml':
+                data = data.replace(b'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml',
+                                    MACRO_CONTENT_TYPE)
+            zf.writestr(info, data)
+
+    result = cli.analyze_excel(path, fix_issues=True, verify=True, index_path=None)
+
+    assert result['success'], result['error']
+    fixed_path = Path(result['file_path'])
+    # 內容類型原樣保留，副檔名必須跟著維持 .xlsm，否則Excel拒絕開啟
+    assert fixed_path.name == "macro.fixed.xlsm"
+    with zipfile.ZipFile(fixed_path) as zf:
+        assert MACRO_CONTENT_TYPE in zf.read('[Content_Types].xml')
+    assert [p.suffix for p in tmp_path.glob("macro.backup_*")] == [".xlsm"]
+    assert openpyxl.load_workbook(fixed_path, keep_vba=True).sheetnames == ["資料1"]
@@ -0,0 +1,105 @@
+"""
+執行紀錄：附加每次執行的結果，並以 stats 子命令的SQL彙整
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import excel_analyzer_cli as cli
+
+
+def _record(history, path, mode, started_at, total_seconds):
+    cli.start_run_record()
+    result = cli.analyze_excel(path, index_path=None)
+    cli.append_history(history, mode, path, result, started_at, total_seconds)
+    return result
+
+
+def test_stats_count_files_not_runs(tmp_path, make_workbook):
+    history = tmp_path / 'history.sqlite3'
+    phantom = make_workbook('phantom.xlsx', phantom_row=5000)
+    clean = make_workbook('clean.xlsx')
+    # 同一個有幽靈範圍的檔案上傳兩次，另有一個正常檔案
+    _record(history, phantom, 'cli', 1000.0, 1.0)
+    _record(history, phantom, 'watch', 1600.0, 2.0)
+    _record(history, clean, 'watch', 2800.0, 4.0)
+
+    stats = cli.history_stats(history)
+
+    assert stats['runs'] == {('cli', 'success'): 1, ('watch', 'success'): 2}
+    assert stats['files'] == 2
+    assert stats['files_with_phantom'] == 1
+    assert stats['phantom_sheets'] == 2
+    assert stats['phantom_rows'] == 2 * (5000 - 2)
+    assert stats['window_seconds'] == 1800.0
+    assert stats['files_per_hour'] == pytest.approx(6.0)
+    assert stats['latency_count'] == 3 and stats['latency_sum'] == 7.0
+    assert stats['latency'][0.5] == 2.0
+    assert stats['latency'][0.9] == pytest.approx(3.6)
+
+
+def test_stats_since_filters_older_runs(tmp_path, make_workbook):
+    history = tmp_path / 'history.sqlite3'
+    phantom = make_workbook('phantom.xlsx', phantom_row=5000)
+    _record(history, phantom, 'cli', 1000.0, 1.0)
+    _record(history, make_workbook('clean.xlsx'), 'cli', 2000.0, 3.0)
+
+    stats = cli.history_stats(history, since=1500.0)
+
+    assert stats['files'] == 1
+    assert stats['files_with_phantom'] == 0
+    assert stats['phantom_fix_seconds'] == 0
+    assert stats['latency'] == {0.5: 3.0, 0.9: 3.0, 0.99: 3.0}
+
+
+def test_prometheus_output_labels_files(tmp_path, make_workbook):
+    history = tmp_path / 'history.sqlite3'
+    phantom = make_workbook('phantom.xlsx', phantom_row=5000)
+    _record(history, phantom, 'cli', 1000.0, 1.0)
+    _record(history, phantom, 'cli', 1001.0, 1.0)
+
+    text = cli.format_prometheus(cli.history_stats(history))
+
+    assert 'excel_analyzer_files_with_phantom 1\n' in text
+    assert 'excel_analyzer_runs{mode="cli",outcome="success"} 2\n' in text
+
+
+def test_xlsx_key_reads_only_the_central_directory(tmp_path, make_workbook, monkeypatch):
+    original = make_workbook('a.xlsx', {'Sheet': [['x', 1]]})
+    copy = tmp_path / 'copy.xlsx'
+    copy.write_bytes(original.read_bytes())
+    changed = make_workbook('b.xlsx', {'Sheet': [['x', 2]]})
+    monkeypatch.setattr(cli, 'file_sha256', lambda path: pytest.fail("不應讀取整個檔案"))
+
+    assert cli.file_content_key(original) == cli.file_content_key(copy)
+    assert cli.file_content_key(original) != cli.file_content_key(changed)
+
+
+def test_non_zip_key_falls_back_to_file_hash(tmp_path):
+    legacy = tmp_path / 'old.xls'
+    legacy.write_bytes(b'\xd0\xcf\x11\xe0' + b'\0' * 1000)
+
+    assert cli.file_content_key(legacy) == cli.file_sha256(legacy)
+
+
+def test_cli_and_stats_run_without_numpy(tmp_path, make_workbook):
+    # numpy 只有報告腳本需要；檢測與 stats 在沒有安裝時也要能執行
+    path = make_workbook(phantom_row=5000)
+    history = tmp_path / 'history.sqlite3'
+    script = (
+        "import sys; sys.modules['numpy'] = None; sys.path.insert(0, sys.argv[1]);"
+        "import excel_analyzer_cli as cli; sys.argv = sys.argv[1:]; sys.argv[0] = 'excel_analyzer_cli.py';"
+        "cli.main()"
+    )
+    root = str(Path(cli.__file__).resolve().parent)
+    check = subprocess.run([sys.executable, '-c', script, root, str(path), '--check', '--no-index',
+                            '--history', str(history)], capture_output=True, text=True)
+    stats = subprocess.run([sys.executable, '-c', script, root, 'stats', '--history', str(history)],
+                           capture_output=True, text=True)
+
+    assert check.returncode == 1, check.stderr
+    assert stats.returncode == 0, stats.stderr
+    assert cli.history_stats(history)['files_with_phantom'] == 1
@@ -0,0 +1,114 @@
+"""
+清理未使用的zip成員：從 _rels/.rels 走訪關聯，並同步改寫 .rels 與 [Content_Types].xml
+"""
+
+import posixpath
+import re
+import zipfile
+
+import openpyxl
+import pytest
+
+import excel_analyzer_cli as cli
+
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+ORPHAN_IMAGE = 'xl/media/unused.png'
+ORPHAN_PART = 'xl/orphan/custom.xml'
+USED_IMAGE = 'xl/media/image1.png'
+CALC_CHAIN = 'xl/calcChain.xml'
+PIVOT_DEFINITION = 'xl/pivotCache/pivotCacheDefinition1.xml'
+PIVOT_RECORDS = 'xl/pivotCache/pivotCacheRecords1.xml'
+
+
+def _relationship(rel_id, rel_type, target):
+    return f'<Relationship Id="{rel_id}" Type="{REL_NS}/{rel_type}" Target="{target}"/>'
+
+
+def _rels(*relationships):
+    return (f'<Relationships xmlns="{cli.PKG_REL_NS}">' + ''.join(relationships) + '</Relationships>').encode()
+
+
+def _override(part, content_type):
+    return f'<Override PartName="/{part}" ContentType="application/vnd.test.{content_type}+xml"/>'
+
+
+@pytest.fixture
+def package(make_workbook, rewrite_package):
+    """活頁簿加上：被工作表參照的圖片、沒有任何參照的圖片與part、calcChain、含快取記錄的樞紐分析快取"""
+    path = make_workbook(phantom_row=5000)
+    return rewrite_package(path, {
+        'xl/worksheets/_rels/sheet1.xml.rels': _rels(_relationship('rId1', 'image', '../media/image1.png')),
+        USED_IMAGE: b'\x89PNG used',
+        ORPHAN_IMAGE: b'\x89PNG unused' * 100,
+        ORPHAN_PART: b'<custom/>',
+        CALC_CHAIN: f'<calcChain xmlns="{MAIN_NS}"><c r="A1" i="1"/></calcChain>',
+        PIVOT_DEFINITION: (f'<pivotCacheDefinition xmlns="{MAIN_NS}" xmlns:r="{REL_NS}" r:id="rId1" '
+                           'refreshOnLoad="0" recordCount="1"><cacheFields count="0"/></pivotCacheDefinition>'),
+        'xl/pivotCache/_rels/pivotCacheDefinition1.xml.rels':
+            _rels(_relationship('rId1', 'pivotCacheRecords', 'pivotCacheRecords1.xml')),
+        PIVOT_RECORDS: f'<pivotCacheRecords xmlns="{MAIN_NS}" count="1"><r/></pivotCacheRecords>',
+        'xl/_rels/workbook.xml.rels': lambda data: data.replace(b'</Relationships>', (
+            _relationship('rIdCalc', 'calcChain', 'calcChain.xml')
+            + _relationship('rIdPivot', 'pivotCacheDefinition', 'pivotCache/pivotCacheDefinition1.xml')
+            + '</Relationships>').encode()),
+        '[Content_Types].xml': lambda data: data.replace(b'</Types>', (
+            '<Default Extension="png" ContentType="image/png"/>'
+            + _override(ORPHAN_PART, 'custom') + _override(CALC_CHAIN, 'calcChain')
+            + _override(PIVOT_DEFINITION, 'pivotDefinition') + _override(PIVOT_RECORDS, 'pivotRecords')
+            + '</Types>').encode()),
+    })
+
+
+def _override_parts(content_types):
+    return set(re.findall(rb'PartName="/([^"]+)"', content_types))
+
+
+def _plan(path, **options):
+    with zipfile.ZipFile(path) as zf:
+        return cli.plan_package_prune(zf, **options)
+
+
+def test_unreferenced_members_are_removed(package):
+    plan = _plan(package)
+
+    assert set(plan['removed']) == {ORPHAN_IMAGE, ORPHAN_PART}
+    assert plan['removed'][ORPHAN_IMAGE][0] == "沒有任何關聯參照"
+    assert set(plan['replaced']) == {cli.CONTENT_TYPES_PART}
+    overrides = _override_parts(plan['replaced'][cli.CONTENT_TYPES_PART])
+    assert ORPHAN_PART.encode() not in overrides
+    assert {CALC_CHAIN.encode(), PIVOT_RECORDS.encode()} <= overrides
+    assert b'Extension="png"' in plan['replaced'][cli.CONTENT_TYPES_PART]
+
+
+def test_strip_options_cut_relationships(package):
+    plan = _plan(package, strip_pivot_records=True, strip_calc_chain=True)
+
+    assert plan['removed'][CALC_CHAIN][0] == cli.PRUNE_REASONS[cli.REL_TYPE_CALC_CHAIN]
+    assert plan['removed'][PIVOT_RECORDS][0] == cli.PRUNE_REASONS[cli.REL_TYPE_PIVOT_CACHE_RECORDS]
+    workbook_rels = plan['replaced']['xl/_rels/workbook.xml.rels']
+    assert b'calcChain' not in workbook_rels and b'rIdPivot' in workbook_rels
+    assert b'pivotCacheRecords' not in plan['replaced']['xl/pivotCache/_rels/pivotCacheDefinition1.xml.rels']
+    definition = plan['replaced'][PIVOT_DEFINITION]
+    assert b'r:id=' not in definition
+    assert definition.count(b'refreshOnLoad') == 1 and b'refreshOnLoad="1"' in definition
+    assert _override_parts(plan['replaced'][cli.CONTENT_TYPES_PART]).isdisjoint(
+        {CALC_CHAIN.encode(), PIVOT_RECORDS.encode(), ORPHAN_PART.encode()})
+
+
+def test_pruned_fix_output_is_consistent(package):
+    result = cli.analyze_excel(package, fix_issues=True, verify=True, index_path=None, prune=True,
+                               strip_pivot_records=True, strip_calc_chain=True)
+    assert result['success'], result['error']
+
+    with zipfile.ZipFile(result['file_path']) as zf:
+        names = set(zf.namelist())
+        assert names.isdisjoint({ORPHAN_IMAGE, ORPHAN_PART, CALC_CHAIN, PIVOT_RECORDS})
+        assert {USED_IMAGE, PIVOT_DEFINITION} <= names
+        # 每個 Override 與關聯目標都必須存在
+        assert {part.decode() for part in _override_parts(zf.read(cli.CONTENT_TYPES_PART))} <= names
+        for rels_name in (name for name in names if name.endswith('.rels')):
+            source = posixpath.join(posixpath.dirname(posixpath.dirname(rels_name)),
+                                    posixpath.basename(rels_name)[:-len('.rels')])
+            assert {target for _, target, _ in cli._read_rels(zf, source).values()} <= names, rels_name
+    assert openpyxl.load_workbook(result['file_path']).sheetnames == ['Sheet']
@@ -0,0 +1,103 @@
+"""
+工作表分析索引：以 (CRC, 大小, 空白共用字串摘要) 為鍵，只重新掃描內容改變的工作表
+"""
+
+import zipfile
+
+import pytest
+
+import excel_analyzer_cli as cli
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+SHARED_STRINGS_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml'
+SHARED_STRINGS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings'
+
+
+@pytest.fixture
+def shared_strings_workbook(make_workbook, rewrite_package):
+    """建立第一列參照共用字串 0、1 的活頁簿（openpyxl寫檔時只產生行內字串）"""
+    def make(name, strings):
+        path = make_workbook(name, {'文字': [['x']], '數字': [[1, 2], [3, 4]]})
+        sheet = (f'<worksheet xmlns="{MAIN_NS}"><dimension ref="A1:B1"/><sheetData><row r="1">'
+                 '<c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c></row></sheetData></worksheet>')
+        table = ''.join(f'<si><t xml:space="preserve">{text}</t></si>' for text in strings)
+        return rewrite_package(path, {
+            'xl/worksheets/sheet1.xml': sheet,
+            'xl/sharedStrings.xml': f'<sst xmlns="{MAIN_NS}" count="{len(strings)}">{table}</sst>',
+            'xl/_rels/workbook.xml.rels': lambda data: data.replace(
+                b'</Relationships>',
+                f'<Relationship Id="rIdSS" Type="{SHARED_STRINGS_REL}" Target="sharedStrings.xml"/>'
+                '</Relationships>'.encode()),
+            '[Content_Types].xml': lambda data: data.replace(
+                b'</Types>',
+                f'<Override PartName="/xl/sharedStrings.xml" ContentType="{SHARED_STRINGS_TYPE}"/></Types>'.encode()),
+        })
+    return make
+
+
+def _scan(path, index):
+    """回傳 {工作表名稱: (分析結果, 是否沿用索引)}"""
+    with zipfile.ZipFile(path) as zf:
+        parts = cli.read_workbook_parts(zf)
+        return {name: (analysis, cached)
+                for name, analysis, cached in cli.iter_sheet_analyses(zf, parts, parts['sheets'], index)}
+
+
+def _empty_index():
+    return {'version': cli.SHEET_INDEX_VERSION, 'sheets': {}, 'blank_strings': {}}
+
+
+def test_unchanged_sheets_are_reused(shared_strings_workbook):
+    index = _empty_index()
+    first = _scan(shared_strings_workbook('a.xlsx', ['a', 'b']), index)
+    second = _scan(shared_strings_workbook('b.xlsx', ['a', 'b']), index)
+
+    assert not any(cached for _, cached in first.values())
+    assert all(cached for _, cached in second.values())
+    assert {name: analysis for name, (analysis, _) in second.items()} == \
+           {name: analysis for name, (analysis, _) in first.items()}
+
+
+def test_changed_sheet_crc_rescans_only_that_sheet(make_workbook):
+    index = _empty_index()
+    _scan(make_workbook('a.xlsx', {'文字': [['x']], '數字': [[1, 2]]}), index)
+    result = _scan(make_workbook('b.xlsx', {'文字': [['x']], '數字': [[1, 2], [3, 4]]}), index)
+
+    assert result['文字'][1] is True
+    assert result['數字'][1] is False
+    assert result['數字'][0]['actual_rows'] == 2
+
+
+def test_changed_blank_string_digest_invalidates(shared_strings_workbook):
+    index = _empty_index()
+    before = _scan(shared_strings_workbook('a.xlsx', ['a', 'b']), index)
+    # 工作表XML不變，但它參照的共用字串 1 變成空白，B1 不再算實際內容
+    after = _scan(shared_strings_workbook('b.xlsx', ['a', ' ']), index)
+
+    assert before['文字'][0]['actual_cols'] == 2
+    assert after['文字'] == (dict(after['文字'][0], actual_cols=1), False)
+    assert after['數字'][1] is False
+    assert len(index['blank_strings']) == 2
+
+
+def test_changed_text_with_same_blank_strings_keeps_entries(shared_strings_workbook):
+    index = _empty_index()
+    _scan(shared_strings_workbook('a.xlsx', ['a', 'b']), index)
+    result = _scan(shared_strings_workbook('b.xlsx', ['a', 'changed']), index)
+
+    assert all(cached for _, cached in result.values())
+
+
+def test_index_file_round_trip(make_workbook, tmp_path, monkeypatch):
+    index_path = tmp_path / 'cache' / cli.SHEET_INDEX_FILENAME
+    path = make_workbook(phantom_row=5000)
+    first = cli.analyze_excel(path, index_path=str(index_path))
+
+    scanned = []
+    analyze_sheet_part = cli.analyze_sheet_part
+    monkeypatch.setattr(cli, 'analyze_sheet_part', lambda *args: scanned.append(args[1]) or analyze_sheet_part(*args))
+    second = cli.analyze_excel(path, index_path=str(index_path))
+
+    assert scanned == []
+    assert first['issues_count'] == second['issues_count'] == 1
+    assert len(cli.load_sheet_index(index_path)['sheets']) == 1
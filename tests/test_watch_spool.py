@@ -0,0 +1,133 @@
+"""
+佇列監看模式：認領、租約過期回收與重試
+"""
+
+import os
+import shutil
+import time
+
+import excel_analyzer_cli as cli
+
+
+def _expire(job_dir, attempts=1):
+    """把工作目錄的租約改為已過期，模擬持有者當機"""
+    lease = cli.read_lease(job_dir)
+    lease.update({'host': 'other-host', 'pid': 1, 'attempts': attempts, 'expires_at': time.time() - 1})
+    cli._write_json_atomic(job_dir / cli.LEASE_SUFFIX, lease)
+
+
+def _enqueue(spool, source, name):
+    shutil.copy(source, spool['inbox'] / name)
+    os.utime(spool['inbox'] / name, (time.time() - 60, time.time() - 60))
+
+
+def test_claim_moves_file_into_leased_job_dir(tmp_path, make_workbook):
+    spool = cli.init_spool(tmp_path / 'spool')
+    _enqueue(spool, make_workbook(), 'a.xlsx')
+
+    job_dir, path, attempts = cli.claim_next_file(spool, 60, 0)
+
+    assert path == job_dir / 'a.xlsx' and path.exists()
+    assert attempts == 1
+    assert cli.owns_lease(job_dir)
+    assert list(spool['inbox'].iterdir()) == []
+    assert cli.claim_next_file(spool, 60, 0) is None
+
+
+def test_claim_skips_unsettled_and_hidden_files(tmp_path, make_workbook):
+    spool = cli.init_spool(tmp_path / 'spool')
+    shutil.copy(make_workbook(), spool['inbox'] / 'fresh.xlsx')
+    shutil.copy(make_workbook(), spool['inbox'] / '.upload.tmp')
+
+    assert cli.claim_next_file(spool, 60, 30) is None
+
+
+def test_reclaim_returns_expired_job_and_counts_attempts(tmp_path, make_workbook):
+    spool = cli.init_spool(tmp_path / 'spool')
+    _enqueue(spool, make_workbook(), 'a.xlsx')
+    job_dir, _, _ = cli.claim_next_file(spool, 60, 0)
+    _expire(job_dir)
+
+    cli.reclaim_expired_leases(spool, 60)
+
+    assert not job_dir.exists()
+    assert (spool['inbox'] / 'a.xlsx').exists()
+    _, _, attempts = cli.claim_next_file(spool, 60, 0)
+    assert attempts == 2
+
+
+def test_reclaim_keeps_both_files_when_name_was_reuploaded(tmp_path, make_workbook):
+    spool = cli.init_spool(tmp_path / 'spool')
+    original = make_workbook('original.xlsx', {'Sheet': [['原始']]})
+    reupload = make_workbook('reupload.xlsx', {'Sheet': [['新上傳']]})
+    _enqueue(spool, original, 'a.xlsx')
+    job_dir, _, _ = cli.claim_next_file(spool, 60, 0)
+    _expire(job_dir)
+    _enqueue(spool, reupload, 'a.xlsx')
+
+    cli.reclaim_expired_leases(spool, 60)
+
+    assert not job_dir.exists()
+    returned = spool['inbox'] / f"{job_dir.name}-a.xlsx"
+    assert returned.read_bytes() == original.read_bytes()
+    assert (spool['inbox'] / 'a.xlsx').read_bytes() == reupload.read_bytes()
+    # 新上傳的檔案不沿用舊檔的嘗試次數
+    assert not (spool['inbox'] / f".a.xlsx{cli.ATTEMPTS_SUFFIX}").exists()
+
+
+def test_reclaim_fails_file_after_max_attempts(tmp_path, make_workbook):
+    spool = cli.init_spool(tmp_path / 'spool')
+    _enqueue(spool, make_workbook(), 'a.xlsx')
+    job_dir, _, _ = cli.claim_next_file(spool, 60, 0)
+    _expire(job_dir, attempts=cli.SPOOL_MAX_ATTEMPTS)
+
+    cli.reclaim_expired_leases(spool, 60)
+
+    assert not job_dir.exists()
+    assert (spool['failed'] / 'a.xlsx').exists()
+    sidecar = cli.json.loads((spool['failed'] / 'a.xlsx.json').read_text(encoding='utf-8'))
+    assert sidecar['result']['success'] is False
+
+
+def test_finalize_drops_result_when_lease_was_lost(tmp_path, make_workbook):
+    spool = cli.init_spool(tmp_path / 'spool')
+    _enqueue(spool, make_workbook(), 'a.xlsx')
+    job_dir, path, _ = cli.claim_next_file(spool, 60, 0)
+    _expire(job_dir)
+
+    result = {'success': True, 'has_issues': False, 'file_path': str(path), 'issues_count': 0, 'error': None}
+    assert cli.finalize_spool_job(spool, job_dir, 'a.xlsx', result, time.time()) is False
+    assert list(spool['done'].iterdir()) == []
+    assert not cli.renew_lease(job_dir, 'a.xlsx', 60, 1)
+
+
+def test_renewal_covers_queued_retries(tmp_path, make_workbook):
+    spool = cli.init_spool(tmp_path / 'spool')
+    _enqueue(spool, make_workbook(), 'a.xlsx')
+    _enqueue(spool, make_workbook(), 'b.xlsx')
+    running_dir, running_path, _ = cli.claim_next_file(spool, 1, 0)
+    queued_dir, queued_path, _ = cli.claim_next_file(spool, 1, 0)
+    in_flight = {'future': (running_dir, running_path.name, time.time(), 1)}
+    retries = [(queued_dir, queued_path.name, time.time(), 2)]
+
+    cli.renew_job_leases(in_flight, retries, 60)
+
+    # 等待重試的工作也續約了，本程序的回收流程不會把它退回收件匣
+    assert cli.read_lease(queued_dir)['expires_at'] > time.time() + 30
+    assert cli.read_lease(queued_dir)['attempts'] == 2
+    time.sleep(1.1)
+    cli.reclaim_expired_leases(spool, 60)
+    assert queued_path.exists() and running_path.exists()
+    assert len(retries) == 1 and len(in_flight) == 1
+
+
+def test_renewal_drops_retries_whose_lease_was_lost(tmp_path, make_workbook):
+    spool = cli.init_spool(tmp_path / 'spool')
+    _enqueue(spool, make_workbook(), 'a.xlsx')
+    job_dir, path, _ = cli.claim_next_file(spool, 60, 0)
+    _expire(job_dir)
+    retries = [(job_dir, path.name, time.time(), 2)]
+
+    cli.renew_job_leases({}, retries, 60)
+
+    assert retries == []